@@ -0,0 +1,227 @@
+"""Backtest of the battery dispatch on price forecasts, settled on the actual prices.
+
+batopt.solve() optimizes and settles on the same prices, i.e. under perfect foresight, which overstates the revenue
+that a real operator earns. backtest() instead takes two aligned price vectors (same start and time vector):
+
+	1) The dispatch is optimized day by day (per market day, so 23 or 25 hours on the DST days) on the FORECAST,
+	   with the stored energy carried from one day to the next.
+	2) The resulting Pch/Pdis are settled on the ACTUAL prices in a single vectorized pass (batopt.calc_opstats()).
+	3) The same is done with the actual prices as the forecast (perfect foresight of each day), or with one model
+	   over the whole period (reference='period'), as the reference.
+
+One day model is formulated per day length and reused across the period: for each day, only the objective
+coefficients (and the starting charge) are updated before optimizing, instead of formulating a new model.
+
+"""
+import numpy as np
+import pandas as pd
+
+import batopt as bo
+
+
+class _DayModels():
+	"""The day models of a backtest, per number of time steps. Each is a formulated batopt whose objective is updated
+	for the day to optimize."""
+
+	def __init__(self, batspecs, market_time, env=None):
+		self.batspecs = batspecs
+		self.market_time = market_time
+		self.env = env
+		self.models = {}
+
+		# Bounds of the stored energy (the starting charge is fixed per day, and released with these)
+		self.E_bounds = (batspecs.at['Capacity [kWh]'] * (1 - batspecs.at['DoD [%]'] / 100),
+		                 batspecs.at['Capacity [kWh]'])
+		return
+
+
+	def get(self, n_steps, prices, start_time):
+		"""Returns the day model of n_steps, formulating it for the day at start_time if needed, as
+		(battery, E vars, Pch vars, Pdis vars)."""
+		if n_steps not in self.models:
+			battery = bo.batopt(self.batspecs, name="Day {}".format(n_steps), quiet=True, env=self.env)
+			battery.set_prices(prices, start_time=start_time, market_time=self.market_time)
+
+			dv_vecs = battery.dv_vecs
+			self.models[n_steps] = (battery, list(dv_vecs['E']), list(dv_vecs['Pch'].values[:-1]),
+			                        list(dv_vecs['Pdis'].values[:-1]))
+
+		return self.models[n_steps]
+
+
+	def dispose(self):
+		"""Frees the Gurobi models."""
+		for battery, _, _, _ in self.models.values():
+			battery.prob.dispose()
+		self.models = {}
+		return
+
+
+def _day_bounds(timetable):
+	"""Returns the (start, stop) steps of each market day in timetable."""
+	dates = timetable['date'].values
+	starts = np.flatnonzero(np.r_[True, dates[1:] != dates[:-1]])
+	stops = np.r_[starts[1:], len(dates)]
+	return list(zip(starts, stops))
+
+
+def _dispatch_daily(prices, day_models, days, delta_t, start_labels, initial_charge=None):
+	"""Optimizes the dispatch day by day on prices, carrying the stored energy across days.
+
+	ARGUMENTS:
+		prices          Price vector (the forecast)
+
+		day_models      _DayModels instance
+
+		days            List of the (start, stop) steps of the days
+
+		delta_t         Time step in hours
+
+		start_labels    Start time of each day, as ("MM/DD/YYYY", hour) (used to formulate the day models)
+
+		initial_charge  Stored energy at the start [kWh]. If None, the first day chooses it.
+
+	RETURNS:
+		(E, Pch, Pdis, status)
+
+		E               Stored energy at the start of each step, and at the end (length len(prices)+1)
+
+		Pch, Pdis       Charging and discharging power per step
+
+		status          Gurobi status per day. Days that are not solved to optimality are idle.
+	"""
+	prices = np.asarray(prices, dtype='f8')
+	E = np.empty(len(prices)+1)
+	Pch = np.zeros(len(prices))
+	Pdis = np.zeros(len(prices))
+	status = np.empty(len(days), dtype='i4')
+
+	carried = initial_charge
+	for day, ((start, stop), start_time) in enumerate(zip(days, start_labels)):
+		day_prices = prices[start:stop]
+		battery, E_vars, Pch_vars, Pdis_vars = day_models.get(stop - start, day_prices, start_time)
+		prob = battery.prob
+
+		# The day's objective, and its starting charge (the end charge then equals it, by charge neutrality)
+		prob.setAttr('Obj', Pdis_vars, day_prices * delta_t)
+		prob.setAttr('Obj', Pch_vars, -day_prices * delta_t)
+		if carried is not None:
+			E_vars[0].lb = E_vars[0].ub = carried
+		else:
+			E_vars[0].lb, E_vars[0].ub = day_models.E_bounds
+
+		prob.optimize()
+		status[day] = prob.status
+
+		if prob.status == 2:
+			E[start:stop+1] = prob.getAttr('X', E_vars)
+			Pch[start:stop] = prob.getAttr('X', Pch_vars)
+			Pdis[start:stop] = prob.getAttr('X', Pdis_vars)
+			carried = E[stop]
+		else:
+			# Idle
+			E[start:stop+1] = carried if carried is not None else day_models.E_bounds[0]
+
+	return E, Pch, Pdis, status
+
+
+def backtest(model, forecast, actual, start_time, market_time=bo.CA_time, reference='daily', initial_charge=None,
+             env=None):
+	"""Backtests the day-by-day dispatch on the forecast prices, settled on the actual prices.
+
+	ARGUMENTS:
+		model           Battery model (column of batopt.BatteryDefns, or the specs, as in batopt())
+
+		forecast        Forecast prices (the prices known when dispatching)
+
+		actual          Actual prices, aligned with forecast
+
+		start_time      Market time of the first price, as ("MM/DD/YYYY", hour) (see batopt.set_prices())
+
+		market_time     Market time implementation
+
+		reference       Perfect foresight reference: 'daily' (day by day on the actual prices, i.e. the value of a
+						perfect forecast) or 'period' (one batopt model over the whole period, as batopt.solve())
+
+		initial_charge  Stored energy at the start [kWh]. If None, the first day chooses it.
+
+		env             Gurobi environment of the models
+
+	RETURNS:
+		(stats, capture, dispatch)
+
+		stats           DataFrame of operation statistics (see batopt.calc_stats()), with rows (run, month) for the
+						runs 'Planned' (forecast dispatch settled on the forecast), 'Backtest' (forecast dispatch
+						settled on the actual prices) and 'Perfect foresight'
+
+		capture         DataFrame of the 'Net Earnings' of 'Backtest' and 'Perfect foresight' per FULL month and
+						'Overall', and the share captured by the backtest ('Capture [%]')
+
+		dispatch        DataFrame per time step of the prices ('Forecast', 'Actual'), the backtest dispatch ('E' at
+						the start of the step, 'Pch', 'Pdis') and the perfect foresight dispatch ('Pch PF', 'Pdis PF')
+	"""
+	forecast = np.asarray(forecast, dtype='f8')
+	actual = np.asarray(actual, dtype='f8')
+	if forecast.shape != actual.shape or forecast.ndim != 1:
+		raise ValueError("Pls. pass forecast and actual prices as aligned vectors of the same length.")
+	if reference not in ('daily', 'period'):
+		raise ValueError("reference must be 'daily' or 'period'.")
+
+	# ------------------------------------------------------------------- STEP 1: Time (market days, full months)
+	settled = bo.batopt(model, name='Backtest', quiet=True, env=env)
+	settled.set_prices(actual, start_time=start_time, market_time=market_time, formulate=False)
+
+	days = _day_bounds(settled.timetable)
+	start_labels = [(settled.timetable.at[start, 'date'].strftime('%m/%d/%Y'), int(settled.timetable.at[start, 'hr']))
+	                for start, _ in days]
+
+	# ------------------------------------------------------------------- STEP 2: Dispatch
+	day_models = _DayModels(settled.batspecs, market_time, env)
+	try:
+		E, Pch, Pdis, status = _dispatch_daily(forecast, day_models, days, settled.delta_t, start_labels,
+		                                       initial_charge)
+
+		if reference == 'daily':
+			_, Pch_pf, Pdis_pf, _ = _dispatch_daily(actual, day_models, days, settled.delta_t, start_labels,
+			                                        initial_charge)
+	finally:
+		day_models.dispose()
+
+	if reference == 'period':
+		perfect = bo.batopt(settled.batspecs, name='Perfect foresight', quiet=True, env=env)
+		perfect.set_prices(actual, start_time=start_time, market_time=market_time)
+		perfect.solve(calc_stats=False)
+		if perfect.dv_soln is None:
+			raise bo.batoptError("The perfect foresight model was not solved to optimality.")
+
+		Pch_pf = perfect.dv_soln['Pch'].values[:-1].astype('f8')
+		Pdis_pf = perfect.dv_soln['Pdis'].values[:-1].astype('f8')
+		perfect.prob.dispose()
+
+	if (status != 2).any():
+		bo.logger.warning("%d of %d days were not solved to optimality (idle).", (status != 2).sum(), len(days))
+
+	# ------------------------------------------------------------------- STEP 3: Settle (vectorized)
+	stats = pd.concat({
+		'Planned': bo.calc_opstats(forecast, Pch, Pdis, settled.fullmonths, settled.delta_t),
+		'Backtest': bo.calc_opstats(actual, Pch, Pdis, settled.fullmonths, settled.delta_t),
+		'Perfect foresight': bo.calc_opstats(actual, Pch_pf, Pdis_pf, settled.fullmonths, settled.delta_t),
+	}, names=['run', 'month'])
+
+	capture = pd.DataFrame({
+		'Backtest': stats.loc['Backtest', 'Net Earnings'],
+		'Perfect foresight': stats.loc['Perfect foresight', 'Net Earnings'],
+	})
+	capture['Capture [%]'] = capture['Backtest'] / capture['Perfect foresight'] * 100
+
+	dispatch = pd.DataFrame({
+		'Forecast': forecast,
+		'Actual': actual,
+		'E': E[:-1],
+		'Pch': Pch,
+		'Pdis': Pdis,
+		'Pch PF': Pch_pf,
+		'Pdis PF': Pdis_pf,
+	})
+
+	return stats, capture, dispatch
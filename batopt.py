@@ -3,24 +3,39 @@ import numpy as np
 from gurobipy import *
 
 import datetime
-import matplotlib.pyplot as plt
-import seaborn as sns
-sns.set_style("whitegrid")
+import time
+import logging
+import contextlib
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import os
-# Get project directory and load BatteryDefns
+# Get project directory. BatteryDefns is loaded on first use (see get_BatteryDefns()).
 PathProj = os.path.dirname(__file__)
-BatteryDefns = pd.read_pickle("{}//Input//BatteryDefns.pkl".format(PathProj))
 
 # My Modules
 import markettime as mt
+import finance
 CA_time = mt.CA_time
 
 # Options
 options = {
 	'Currency': 'USD',
+	'Model templates': True,        # Build the models from cached templates (see templates.py; requires SciPy and
+	                                # Gurobi 10+)
 }
 
+# The model templates use the matrix API of Gurobi 10+ (addMVar(), addMConstr(), MVar.tolist())
+GUROBI_MATRIX_API = gurobi.version() >= (10,)
+
+# Star-import names (as used by the notebooks). BatteryDefns is loaded on access.
+__all__ = ['batopt', 'batoptError', 'OutsideTimeRange', 'BatteryDefns', 'get_BatteryDefns', 'CA_time', 'options',
+           'PathProj', 'calc_opstats', 'simple_payback', 'solve_async', 'get_executor', 'mt', 'pd', 'np']
+
+# Structured records of the phase timings and model sizes (see batopt._emit()) are logged here at DEBUG level
+logger = logging.getLogger('batopt')
+
 
 class batopt():
 	"""Battery model for energy arbitrage.
@@ -31,6 +46,7 @@ class batopt():
 
 		1) Battery model
 		The batter models are defined in batopt.BatteryDefns. This table defines the specs of each battery system.
+		Alternatively, the specs can be passed directly (as a Series or dict with the same rows as BatteryDefns).
 
 		2) Prices
 		Arbitrage is fundamentally linked to the price profile. The prices are set via the instance method
@@ -40,6 +56,9 @@ class batopt():
 		*If you have wish to separately optimize sub-periods (e.g. months of a year), you have to load the periods
 		separately.
 
+		Prices received later (e.g. one more day, every day) are added with append_prices(), which extends the
+		formulated model at its end instead of formulating it again.
+
 
 	TIME
 		The time vector is implemented via a RANGE INDEX (of self.dv_vecs, self.dv_soln), wherein the
@@ -54,13 +73,42 @@ class batopt():
 			instance.Idx_toMarket()     -- Converts an index along the range index to the market TimeStamp
 
 
+	INSTRUMENTATION
+		Each phase of set_prices() and solve() is timed, and the model size is counted after formulation. These are
+		kept in self.timings ({phase: seconds}) and self.counters, and emitted as records (dicts) to:
+
+			- the callables in self.hooks, as hook(record)
+			- the 'batopt' logger, at DEBUG level, with the record in the 'batopt' attribute of the LogRecord
+
+		Records are {'model': name, 'event': 'phase', 'phase': phase, 'seconds': seconds} per phase,
+		{'model': name, 'event': 'size', **self.counters} after formulation, and {'model': name, 'event': 'template',
+		'source': 'memory'/'disk'/'built'} when formulating from a model template. The phases are:
+
+			bind_prices, fullmonths, timetable      (set_prices, append_prices)
+			template                                (formulation, from a model template)
+			variables, constraints, objective       (formulation, append_prices)
+			optimize, extraction, earnings, stats   (solve)
+
+		With quiet=True, nothing is printed (incl. the Gurobi log); the reports go to the logger at INFO level only.
+
+
+	CONCURRENCY
+		Instances share no mutable state: each copies the module options (self.options) and its battery specs when
+		created, and the market time instances only cache immutable data. Many instances can thus be set up and
+		solved concurrently in one process, each in one thread at a time. Gurobi environments are not thread-safe,
+		so concurrent solves should each pass their own env (the module function solve_async() does this).
+
+		instance.solve_async()      -- Coroutine version of solve(), run in a bounded thread pool (see
+									get_executor()). Cancelling the awaiting task aborts the optimization.
 
 	"""
-	def __init__(self, model, name='Bat 1'):
+	def __init__(self, model, name='Bat 1', quiet=False, hooks=(), env=None):
 		#self.prob = Model(name)
 		self.name = name
 		self.prob = None
-		self.batspecs = BatteryDefns[model]
+		self.env = env                              # Gurobi environment of the model (None for the default one)
+		self.batspecs = get_batspecs(model)
+		self.options = dict(options)                # Copy of the module options (e.g. 'Currency')
 
 		# Price vector
 		self.prices = None                          # Prices as iterable
@@ -74,10 +122,21 @@ class batopt():
 		self.delta_t = None                         # Time resolution of self.market_time, in numeric hours
 													#(whereas self.market_time.delta_t is in datetime.timedelta)
 
+		# Analytics (see __build_cube())
+		self.timetable = None                       # DataFrame of the market labels, prices and dispatch per time step
+		self.cube = None                            # DataFrame of self.timetable aggregated by (month, dow, hr)
+
 		# dv tables and solution objects
 		self.dv_vecs = None                         # DataFrame of Gurobi dv's (rows = len(Prices)+1 for the end point)
+		self._n_fixed = 0                           # Time steps fixed by append_prices(fix_history=True)
 		self.__reset_soln()                         # Attrs are described in the method.
 
+		# Instrumentation (see class docstring)
+		self.quiet = quiet                          # If True, suppresses all prints (incl. the Gurobi log)
+		self.hooks = list(hooks)                    # Callables receiving the instrumentation records
+		self.timings = {}                           # {phase: seconds} of the latest run of each phase
+		self.counters = {}                          # Model size counts of the latest formulation
+
 		return
 
 
@@ -86,11 +145,12 @@ class batopt():
 		self.dv_soln = None                         # DataFrame of the dv solution (same shape as self.dv_vecs)
 		self.earnings = None                        # Series of battery earnings (same length as self.dv_vecs)
 		self.stats = None                           # DataFrame of operational statistcs (see calc_stats())
+		self._kept_soln = None                      # (n_steps, dv_soln, earnings) fixed by append_prices()
 		return
 
 
 
-	def set_prices(self, prices, start_time, market_time):
+	def set_prices(self, prices, start_time, market_time, formulate=True):
 		"""Sets the prices for the defined period and formulates the optimization model. The time vector is inferred
 		from start_time, market_time and the length of prices.
 
@@ -103,6 +163,9 @@ class batopt():
 			market_time     A time implementation defined by an instance of one of the standards in markettime.
 							Currently, only instances of markettime.CAISO are implemented.
 
+			formulate       If True (default), formulates the optimization model. Subclasses that build their own
+							model (e.g. portfolio.portfolio) bind the prices and time only.
+
 		"""
 		if not isinstance(market_time, mt.CAISO):
 			raise NotImplementedError("Only markettime.CAISO time implementations are currently supported.")
@@ -110,40 +173,187 @@ class batopt():
 		self.__reset_soln()
 
 		# ------------------------------------------------------------------- STEP 1: Bind prices and interpret time
-		self.prices = prices
-
-		# 1 Market time implementation
-		self.market_time = market_time
+		with self._phase('bind_prices'):
+			self.prices = prices
 
-		# 2 Set GMT start time
-		start_dt = mt.datetime.datetime.strptime(start_time[0], '%m/%d/%Y')
-		start_time_mkt = market_time.TimeStamp(start_dt, start_time[1])
+			# 1 Market time implementation
+			self.market_time = market_time
 
-		self.start_time = market_time.Market_toGMT(start_time_mkt)
-		self.year = start_dt.year
+			# 2 Set GMT start time
+			start_dt = mt.datetime.datetime.strptime(start_time[0], '%m/%d/%Y')
+			start_time_mkt = market_time.TimeStamp(start_dt, start_time[1])
 
-		# 3 Detect full months
-		batopt.__get_fullmonths(self, start_time_mkt.year)
+			self.start_time = market_time.Market_toGMT(start_time_mkt)
+			self.year = start_dt.year
 
+			# Set duration in numeric hours
+			self.delta_t = self.market_time.delta_t.total_seconds() / 3600
+			if self.delta_t.is_integer():
+				self.delta_t = int(self.delta_t)
 
-		# Set duration in numeric hours
-		self.delta_t = int(self.market_time.delta_t.seconds / 3600)
+		# 3 Detect full months
+		with self._phase('fullmonths'):
+			batopt.__get_fullmonths(self, start_time_mkt.year)
 
+		# 4 Market labels and the analytics cube (prices only, until solved)
+		with self._phase('timetable'):
+			batopt.__build_timetable(self)
+			batopt.__build_cube(self)
 
 
 		# ------------------------------------------------------------------- STEP 2: Proceed to formulation (default)
-		batopt.__formulateprob(self)
+		if formulate:
+			batopt.__formulateprob(self)
 
 		# ------------------------------------------------------------------- REPORT
 		# By calculating end_time, we are guaranteeing that we can calculate all time stamps in the period.
 		# (potential problem - inferred end is not defined in the DST periods)
 		end_time = self.start_time + self.market_time.delta_t*(len(self.prices)-1)
-		print("\nPrices set from {} to {}".format(self.market_time.GMT_toMarket(self.start_time),
-		                                          self.market_time.GMT_toMarket(end_time)))
+		self._report("\nPrices set from {} to {}".format(self.market_time.GMT_toMarket(self.start_time),
+		                                                 self.market_time.GMT_toMarket(end_time)))
 
 		duration = end_time-self.start_time+self.market_time.delta_t
-		print("{} D, {} H".format(duration.days, int(duration.seconds / 3600)))
+		self._report("{} D, {} H".format(duration.days, int(duration.seconds / 3600)))
+
+		return
+
+
+	def append_prices(self, prices, fix_history=False):
+		"""Appends prices to the end of the period, and extends the formulated model with the new time steps: new dv's
+		and constraints at the tail, the charge neutrality moved to the new end and the objective extended. Call
+		solve() afterwards.
+
+		ARGUMENTS:
+			prices          Iterable of the prices that follow the current period (1-D). If empty, nothing is changed.
+
+			fix_history     If True, the dispatch of the current period is fixed to the current solution, so that only
+							the new time steps are optimized (the update cost then depends on the new data, not on
+							the length of the period). The solution and earnings of the fixed steps are kept, and
+							only the new steps are extracted by solve(). Requires a solution.
+							If False, a history fixed by a previous append_prices() is released (bounds of the specs).
+
+		If solved, the current solution is passed as a MIP start (with the battery idle over the new steps, which is
+		feasible), so that the next solve starts from at least the current earnings.
+		"""
+		if self.dv_vecs is None or self.prob is None:
+			raise batoptError("No model. Pls. call set_prices() first.")
+		if fix_history and self.dv_soln is None:
+			raise batoptError("No solution. Cannot fix the history at this point.")
+
+		# Checked before the instance is changed
+		new_prices = np.asarray(prices, dtype='f8')
+		if new_prices.ndim != 1:
+			raise ValueError("Pls. pass the prices as a 1-D vector.")
+		if not len(new_prices):
+			return
+
+		n_old = len(self.prices)
+		n_total = n_old + len(new_prices)
+
+		# ------------------------------------------------------------------- STEP 1: Bind prices and time
+		with self._phase('bind_prices'):
+			self.prices = np.concatenate([np.asarray(self.prices, dtype='f8'), new_prices])
+
+			# Time labels of the new steps (raises before anything is changed, e.g. for an undefined DST period)
+			try:
+				new_rows = batopt.__timetable_rows(self, n_old, len(new_prices))
+			except Exception:
+				self.prices = self.prices[:n_old]
+				raise
+
+		# Prior solution, kept for the MIP start (and as the fixed history)
+		prior_soln, prior_earnings = self.dv_soln, self.earnings
+		self.__reset_soln()
+
+		with self._phase('fullmonths'):
+			batopt.__get_fullmonths(self, self.year)
+
+		with self._phase('timetable'):
+			self.timetable = pd.concat([self.timetable[list(new_rows.columns)], new_rows])
+			batopt.__build_cube(self)
+
+		# ------------------------------------------------------------------- STEP 2: Extend the model
+		with self._phase('variables'):
+			# The final charge of the current period becomes a regular E
+			Efin = self.dv_vecs.at[n_old, 'E']
+			Efin.VarName = "E, {}".format(n_old)
+			Efin.lb = self.batspecs.at['Capacity [kWh]'] * (1 - self.batspecs.at['DoD [%]'] / 100)
+
+			steps = range(n_old, n_total)
+			new_vecs = pd.DataFrame(index=range(n_old, n_total+1), columns=self.dv_vecs.columns)
+			for dv_type in ('Pch', 'Pdis', 'b'):
+				new_vecs[dv_type] = batopt.__create_DVvec(self, dv_type, steps)
+			new_vecs['E'] = batopt.__create_DVvec(self, 'E', range(n_old+1, n_total))
+
+			new_vecs.at[n_old, 'E'] = Efin
+			new_vecs.at[n_total, 'E'] = self.prob.addVar(name="Efin", vtype=GRB.CONTINUOUS, lb=0,
+			                                             ub=self.batspecs.at['Capacity [kWh]'])
+
+			self.dv_vecs = pd.concat([self.dv_vecs.iloc[:n_old], new_vecs])
+			self.prob.update()
+
+		with self._phase('constraints'):
+			batopt.__all_constrs(self, steps)
+
+		with self._phase('objective'):
+			self.prob.setAttr('Obj', list(self.dv_vecs['Pdis'].values[n_old:n_total]), new_prices * self.delta_t)
+			self.prob.setAttr('Obj', list(self.dv_vecs['Pch'].values[n_old:n_total]), -new_prices * self.delta_t)
+
+		# ------------------------------------------------------------------- STEP 3: MIP start / fixed history
+		if not fix_history:
+			batopt.__release_history(self)
+
+		if prior_soln is not None:
+			old_vars = self.dv_vecs.iloc[:n_old]
+			old_vals = prior_soln.iloc[:n_old]
+
+			for dv_type in self.dv_vecs.columns:
+				self.prob.setAttr('Start', list(old_vars[dv_type].values), old_vals[dv_type].values.astype('f8'))
+
+			# Idle over the new steps
+			self.prob.setAttr('Start', list(self.dv_vecs['E'].values[n_old:]),
+			                  [prior_soln.at[n_old, 'E']] * (n_total - n_old + 1))
+			for dv_type in ('Pch', 'Pdis', 'b'):
+				self.prob.setAttr('Start', list(self.dv_vecs[dv_type].values[n_old:n_total]),
+				                  [0.0] * (n_total - n_old))
+
+			if fix_history:
+				# The charge balance then fixes E, up to the start of the new steps
+				fixed = [old_vars.at[0, 'E']] + [dv for dv_type in ('Pch', 'Pdis', 'b') for dv in old_vars[dv_type]]
+				values = [prior_soln.at[0, 'E']] + [val for dv_type in ('Pch', 'Pdis', 'b')
+				                                     for val in old_vals[dv_type].values.astype('f8')]
+				self.prob.setAttr('LB', fixed, values)
+				self.prob.setAttr('UB', fixed, values)
+				self._n_fixed = n_old
+
+				self._kept_soln = (n_old, prior_soln.iloc[:n_old], prior_earnings.iloc[:n_old+1])
 
+		self.prob.update()
+
+		# ------------------------------------------------------------------- REPORT
+		self._count_model()
+		self._report("\nAppended {} prices, up to {}".format(len(new_prices), self.Idx_toMarket(n_total-1)))
+		return
+
+
+	def __release_history(self):
+		"""Restores the bounds of the dv's fixed by append_prices(fix_history=True) to those of the battery specs."""
+		if not self._n_fixed:
+			return
+
+		Er = self.batspecs.at['Capacity [kWh]']
+		Pr = self.batspecs.at['Power [kW]']
+		bounds = {'Pch': (0, Pr), 'Pdis': (0, Pr), 'b': (0, 1)}
+
+		fixed = self.dv_vecs.iloc[:self._n_fixed]
+		dvs = [fixed.at[0, 'E']] + [dv for dv_type in bounds for dv in fixed[dv_type]]
+		lbs = [Er * (1 - self.batspecs.at['DoD [%]'] / 100)] + [bounds[dv_type][0] for dv_type in bounds
+		                                                         for _ in range(self._n_fixed)]
+		ubs = [Er] + [bounds[dv_type][1] for dv_type in bounds for _ in range(self._n_fixed)]
+
+		self.prob.setAttr('LB', dvs, lbs)
+		self.prob.setAttr('UB', dvs, ubs)
+		self._n_fixed = 0
 		return
 
 
@@ -151,35 +361,47 @@ class batopt():
 		"""Solves the optimization problem (battery energy arbitrage). Upon success, extracts the solution and
 		calculates the earnings vector."""
 		# ------------------------------------------------------------------------------- #
-		self.prob.optimize()
+		with self._phase('optimize'):
+			self.prob.optimize()
 
 		if self.prob.status == 2:
-			dv_soln = pd.DataFrame(index=self.dv_vecs.index, columns=self.dv_vecs.columns)
+			with self._phase('extraction'):
+				# Steps fixed by append_prices() keep their solution; only the rest is extracted
+				n_kept = self._kept_soln[0] if self._kept_soln else 0
+				index = self.dv_vecs.index[n_kept:]
+				dv_soln = pd.DataFrame(index=index, columns=self.dv_vecs.columns)
+
+				# Iterate through columns, and exclude final time stamp
+				for vtype, ser in self.dv_vecs.iteritems():
+					ser = ser.loc[index[0:-1]]
+					dv_soln[vtype] = pd.Series(data=[dv.x for dv in ser], index=ser.index)
 
-			# Iterate through columns, and exclude final time stamp
-			for vtype, ser in self.dv_vecs.iteritems():
-				ser = ser.loc[self.dv_vecs.index[0:-1]]
-				dv_soln[vtype] = pd.Series(data=[dv.x for dv in ser], index=ser.index)
+				# Add final energy
+				dv_soln.at[index[-1], 'E'] = self.dv_vecs.at[index[-1], 'E'].x
 
-			# Add final energy
-			dv_soln.at[self.dv_vecs.index[-1], 'E'] = self.dv_vecs.at[self.dv_vecs.index[-1], 'E'].x
+				# Assert Pch XOR Pdis
+				assert all(dv_soln.at[t, 'Pch'] * dv_soln.at[t, 'Pdis'] == 0 for t in dv_soln.index[0:-1])
 
-			# Assert Pch XOR Pdis
-			assert all(dv_soln.at[t, 'Pch'] * dv_soln.at[t, 'Pdis'] == 0 for t in dv_soln.index[0:-1])
-			# Assert charge neutrality
-			assert dv_soln.at[dv_soln.index[0], 'E'] == dv_soln.at[dv_soln.index[-1], 'E']
+				if self._kept_soln:
+					dv_soln = pd.concat([self._kept_soln[1], dv_soln])
+
+				# Assert charge neutrality
+				assert dv_soln.at[dv_soln.index[0], 'E'] == dv_soln.at[dv_soln.index[-1], 'E']
 
 			# Print revenue
-			print("\n\nGenerated revenue of {:0.2f} {} from {} to {}".format(self.prob.objval, options['Currency'],
-			                                                                 self.Idx_toMarket(self.dv_vecs.index[0]),
-			                                                                 self.Idx_toMarket(self.dv_vecs.index[-2])))
+			self._report("\n\nGenerated revenue of {:0.2f} {} from {} to {}".format(
+				self.prob.objval, self.options['Currency'], self.Idx_toMarket(self.dv_vecs.index[0]),
+				self.Idx_toMarket(self.dv_vecs.index[-2])))
 
 
 			# ------------------------------------ EXIT ------------------------------------------- #
 			# Bind soln
 			self.dv_soln = dv_soln
 			# Calculate earnings
-			self.__calc_earnings()
+			with self._phase('earnings'):
+				self.__calc_earnings()
+				# Add the dispatch to the analytics cube
+				batopt.__build_cube(self)
 
 			if calc_stats: self.calc_stats()
 
@@ -199,44 +421,76 @@ class batopt():
 			Net Earning             Energy Revenue - Energy Cost
 
 		"""
-		multp = 10**-3 # kWh to MWh conversion
+		with self._phase('stats'):
+			self.stats = calc_opstats(self.prices, self.dv_soln['Pch'].values[:-1], self.dv_soln['Pdis'].values[:-1],
+			                          self.fullmonths, self.delta_t)
+		return
 
-		PricesSer = pd.Series(data=self.prices, index=range(len(self.prices)))
 
-		self.stats = pd.DataFrame(index=[mt.month_abrv[mm] for mm in self.fullmonths]+['Overall'],
-		                          columns=['Energy Consumed', 'Energy Released', 'Energy Lost', 'Energy Revenue',
-		                                   'Energy Costs', 'Net Earnings'])
+	async def solve_async(self, calc_stats=True, executor=None):
+		"""Coroutine version of solve(). The solve runs in executor (defaults to get_executor()), so that the event
+		loop is not blocked. If the awaiting task is cancelled, the optimization is aborted (Model.terminate()) and
+		CancelledError is raised once solve() has returned; a solve still queued in the executor is dropped."""
+		cfuture = (executor or get_executor()).submit(self.solve, calc_stats)
+		future = asyncio.wrap_future(cfuture)
+
+		try:
+			await asyncio.shield(future)
+		except asyncio.CancelledError:
+			if not cfuture.cancel():
+				# Already running. Repeated until solve() returns, in case optimize() had not started yet.
+				while not cfuture.done():
+					self.prob.terminate()
+					await asyncio.wait([future], timeout=0.05)
+			raise
 
-		# -------------------------------------------------------------------------------- Step 1: Calc stats
-		for mm in {**self.fullmonths, 'Overall':None}:
-			try:
-				start_idx, end_idx = self.fullmonths[mm]
-				mmm = mt.month_abrv[mm]
-			except KeyError: # for 'Overall'
-				start_idx = 0
-				end_idx = len(self.prices)-1
-				mmm = mm
-
-			Pch_sub = self.dv_soln.loc[start_idx:end_idx, 'Pch']
-			Pdis_sub = self.dv_soln.loc[start_idx:end_idx, 'Pdis']
-			Price_sub = PricesSer.loc[start_idx:end_idx]
-
-			# ENERGY
-			self.stats.at[mmm, 'Energy Consumed'] = Pch_sub.sum()*self.delta_t*multp
-			self.stats.at[mmm, 'Energy Released'] = Pdis_sub.sum()*self.delta_t*multp
-			self.stats.at[mmm, 'Energy Lost'] = self.stats.at[mmm, 'Energy Consumed'] - \
-			                                    self.stats.at[mmm, 'Energy Released']
-
-			# CASH
-			self.stats.at[mmm, 'Energy Revenue'] = round((Price_sub*Pdis_sub).sum()*self.delta_t, 2)
-			self.stats.at[mmm, 'Energy Costs'] = round((Price_sub*Pch_sub).sum()*self.delta_t, 2)
-			self.stats.at[mmm, 'Net Earnings'] = self.stats.at[mmm, 'Energy Revenue'] - \
-			                                     self.stats.at[mmm, 'Energy Costs']
+		return
+
+
+	@contextlib.contextmanager
+	def _phase(self, phase):
+		"""Context manager that times a phase, and emits it (see class docstring). Also used by subclasses."""
+		start = time.perf_counter()
+		yield
+		self.timings[phase] = time.perf_counter() - start
+		self._emit({'event': 'phase', 'phase': phase, 'seconds': self.timings[phase]})
+		return
+
+
+	def _emit(self, record):
+		"""Sends an instrumentation record to the hooks and the logger."""
+		record = {'model': self.name, **record}
+		for hook in self.hooks:
+			hook(record)
+
+		logger.debug("%s", record, extra={'batopt': record})
+		return
+
+
+	def _count_model(self):
+		"""Sets self.counters from the (updated) Gurobi model, and emits them."""
+		self.counters = {
+			'n_steps': len(self.prices),
+			'NumVars': self.prob.NumVars,
+			'NumBinVars': self.prob.NumBinVars,
+			'NumConstrs': self.prob.NumConstrs,
+			'NumNZs': self.prob.NumNZs,
+		}
+		self._emit({'event': 'size', **self.counters})
+		return
+
+
+	def _report(self, msg):
+		"""Prints msg, unless quiet. Always logged at INFO level."""
+		if not self.quiet:
+			print(msg)
+		logger.info(msg.strip())
 		return
 
 
 	def plot_24hOperation(self, date):
 		"""Plots the battery operation and prices for the given date (as "mmm dd")"""
+		plt, sns = _plotting()
 
 		# ------------------------------------------------------------------------------------ Get range
 		dt = datetime.datetime.strptime(date, "%b %d").replace(year=self.year)
@@ -244,11 +498,10 @@ class batopt():
 		# Pch, Pdis must be filtered [start_idx, endpt_idx)
 		# E         must be filtered [start_idx, endpt_idx]
 		start_idx = self.Market_toIdx(self.market_time.TimeStamp(dt, 'first'))
-		endpt_idx = start_idx + 1
 
-		# Exit while if endpt_idx points to the next day (or if endpt_idx=len(self.prices)
-		while endpt_idx < len(self.prices) and self.Idx_toMarket(endpt_idx).day == dt.day:
-			endpt_idx += 1
+		# The day has 23-25 market hours; endpt_idx is capped at len(self.prices)
+		steps_per_hr = int(mt.delta_hr / self.market_time.delta_t)
+		endpt_idx = min(start_idx + len(self.market_time.day_hours(dt))*steps_per_hr, len(self.prices))
 
 		# ----------------------------------------------------------------------------------------- PLOT 1: OPERATION
 		# ---------------------------------------------------------------------- Main plots
@@ -287,8 +540,8 @@ class batopt():
 		ax.legend(loc=1)
 		plt.show()
 		# ----------------------------------------------------------------------------------------- Report day revenue
-		print("Revenue: {} {}".format(round(self.earnings.at[endpt_idx]-self.earnings.at[start_idx], 2),
-		                              options['Currency']))
+		self._report("Revenue: {} {}".format(round(self.earnings.at[endpt_idx]-self.earnings.at[start_idx], 2),
+		                                     self.options['Currency']))
 
 		# ----------------------------------------------------------------------------------------- PLOT 2: PRICES
 		plt.figure(figsize=(15, 3))
@@ -300,7 +553,7 @@ class batopt():
 		# ------------------------------------------------------------ Formatting
 		# Axes labels
 		ax.set_xlabel('time', fontsize=13, fontname='arial')
-		ax.set_ylabel('Price [{}/MWh]'.format(options['Currency']), fontsize=13, fontname='arial')
+		ax.set_ylabel('Price [{}/MWh]'.format(self.options['Currency']), fontsize=13, fontname='arial')
 
 		# Ticks
 		ax.set_xticks(plt_time[::2])
@@ -317,12 +570,13 @@ class batopt():
 
 	def plot_EarningsOverTime(self):
 		"""Plots the evolution of net income over the period"""
+		plt, sns = _plotting()
 		plt.figure(figsize=(12, 5))
 		ax = sns.lineplot(x=self.earnings.index, y=self.earnings.values)
 
 		# Axes labels
 		ax.set_xlabel(self.Idx_toMarket(0).year, fontsize=13, fontname='arial')
-		ax.set_ylabel(options['Currency'], fontsize=13, fontname='arial')
+		ax.set_ylabel(self.options['Currency'], fontsize=13, fontname='arial')
 
 		# Axes ticks
 		duration = self.market_time.delta_t * len(self.prices)
@@ -347,6 +601,7 @@ class batopt():
 
 	def plot_CashFlows(self, plot='RevAndCosts', Summary=False):
 		"""Bar plot of revenue vs. costs or net earnings of FULL months (supports 1 yr only)"""
+		plt, sns = _plotting()
 		if self.dv_soln is None:
 			raise RuntimeError("No solution. Cannot generate plot at this point.")
 		if self.prob.status == 2 and self.stats is None:
@@ -377,7 +632,7 @@ class batopt():
 		ax = plt.gca()
 		# Axes labels
 		ax.set_xlabel(self.Idx_toMarket(0).year, fontsize=13, fontname='arial')
-		ax.set_ylabel(options['Currency'], fontsize=13, fontname='arial')
+		ax.set_ylabel(self.options['Currency'], fontsize=13, fontname='arial')
 
 		# Axes ticks
 		ax.set_xticks([val for val in mt.month_abrv.values()])
@@ -398,45 +653,38 @@ class batopt():
 		# --------------------------------------------------------- Summary
 		if Summary:
 			for key, val in self.stats.loc['Overall', ['Energy Revenue', 'Energy Costs', 'Net Earnings']].iteritems():
-				print("{} \t {} {}".format(key, val, options['Currency']))
+				self._report("{} \t {} {}".format(key, val, self.options['Currency']))
 
 		if abs(self.stats.loc[Lf, 'Net Earnings'].sum() - self.stats.at['Overall', 'Net Earnings']) > 10 ** -4:
-			print("Partial months are not plotted.")
+			self._report("Partial months are not plotted.")
 		return
 
 
 	def plot_monthprices(self, month: str):
 		"""Plots an aggregated, 24-hr price profile for the specified month (as mmm)"""
+		plt, sns = _plotting()
 		month_num = mt.month_abrv_rev[month]
 
-		if month_num in [dt.month for dt in self.market_time.DST_periods[self.year]]:
-			raise NotImplementedError("The DST switch months are currently not implemented.")
-			# Todo - I think the best soln for this is to increment by the day (date.replace)
-
 		# -------------------------------------------------------------------------------------- Step 1: Fetch prices
-		try:
-			mo_start, mo_end = self.fullmonths[month_num]
-		except KeyError:
+		if month_num not in self.fullmonths:
 			raise ValueError("The entered month is not fully covered in the period.")
-		Prices_byhr = pd.DataFrame(columns=range(24))  # WIDE-format table (columns as hours)
 
-		for hr in range(24):
-			price_thishr = np.array(self.prices[mo_start + hr:mo_end + 1:24], dtype='f8') * 1000
-			Prices_byhr[hr] = pd.Series(data=price_thishr, index=range(len(price_thishr)))
-
-		assert Prices_byhr.isnull().sum().sum() == 0
+		# Grouped by market hour label, so the 23- and 25-hour DST days are handled
+		month_tbl = self.timetable.loc[self.timetable['month'] == month_num]
+		Prices_byhr = {hr: grp['Price'].values * 1000 for hr, grp in month_tbl.groupby('hr')}
 
 		# -------------------------------------------------------------------------------------- Step 2: Plot
 		plt.figure(figsize=(12, 5))
-		plt.boxplot([Prices_byhr[hr] for hr in range(24)])
+		plt.boxplot(list(Prices_byhr.values()))
 		# ----------------------------------------------
 		ax = plt.gca()
+		ax.set_xticklabels(["H{}".format(str(hr).zfill(2)) for hr in Prices_byhr])
 
 		# Axes Title
 		ax.set_title("24-hr aggregated prices for {}".format(month), fontsize=13)
 
 		# Axes labels
-		ax.set_ylabel("{}/MWh".format(options['Currency']), fontsize=12, fontname='arial')
+		ax.set_ylabel("{}/MWh".format(self.options['Currency']), fontsize=12, fontname='arial')
 
 		# Axes ticks
 		ax.tick_params(labelsize=12)
@@ -445,45 +693,175 @@ class batopt():
 		return
 
 
-	def __formulateprob(self):
-		"""Formulates the optimization problem."""
-		self.prob = Model(self.name)
+	def cube_profile(self, column='Price', by='hr', month=None, dow=None):
+		"""Returns the average of column ('Price', 'Charge', 'Discharge' or 'Earnings') per time step, grouped by
+		'hr', 'dow' or 'month', read from self.cube. Optionally filtered to a month (numeric) and/or a day of the week
+		(0=Monday)."""
+		cube = self.cube
+		if month is not None:
+			cube = cube.xs(month, level='month', drop_level=False)
+		if dow is not None:
+			cube = cube.xs(dow, level='dow', drop_level=False)
 
-		# --------------------------------------------------------------------------- STEP 1: Build dvs
-		# DV vector table
-		self.dv_vecs = pd.DataFrame(index=range(len(self.prices)+1), columns=['E', 'Pch', 'Pdis', 'b'])
+		grouped = cube.groupby(level=by)[[column, 'Count']].sum()
+		return grouped[column] / grouped['Count']
 
-		for dv_type in self.dv_vecs.columns:
-			self.dv_vecs[dv_type] = batopt.__create_DVvec(self, dv_type)
 
-		# Final charge
-		self.dv_vecs.at[self.dv_vecs.index[-1], 'E'] = self.prob.addVar(name="Efin", vtype=GRB.CONTINUOUS, lb=0,
-		                                                                ub = self.batspecs.at['Capacity [kWh]'])
+	def __build_timetable(self):
+		"""Sets self.timetable: the market date, month, day of the week and hour label of each time step (range index),
+		with the prices."""
+		self.timetable = batopt.__timetable_rows(self, 0, len(self.prices))
+		return
 
 
-		# --------------------------------------------------------------------------- STEP 2: Build constraints
-		batopt.__all_constrs(self)
+	def __timetable_rows(self, start_idx, n):
+		"""Returns the rows of self.timetable for the n time steps from start_idx."""
+		start_GMT = self.start_time + start_idx*self.market_time.delta_t
 
-		# --------------------------------------------------------------------------- STEP 3: Set objective
-		Obj = LinExpr()
+		if self.market_time.delta_t == mt.delta_hr:
+			stamps = self.market_time.market_range(self.market_time.GMT_toMarket(start_GMT), n)
+		else:
+			# Sub-hourly: every step is converted from GMT
+			stamps = []
+			GMT = start_GMT
+			for idx in range(n):
+				stamps.append(self.market_time.GMT_toMarket(GMT))
+				GMT += self.market_time.delta_t
+
+		return pd.DataFrame({
+			'date': [ts.dt for ts in stamps],
+			'month': np.array([ts.month for ts in stamps], dtype='i4'),
+			'dow': np.array([ts.dt.weekday() for ts in stamps], dtype='i4'),
+			'hr': np.array([ts.hr for ts in stamps], dtype='i4'),
+			'Price': np.asarray(self.prices[start_idx:start_idx+n], dtype='f8'),
+		}, index=range(start_idx, start_idx+n))
+
+
+	def __build_cube(self):
+		"""Sets self.cube, the SUMS of self.timetable per (month, dow, hr) and the number of time steps ('Count').
+		After solving, the dispatch is added to the time table ('Charge', 'Discharge' in kW, and 'Earnings')."""
+		if self.dv_soln is not None:
+			Pch = self.dv_soln['Pch'].values[:-1].astype('f8')
+			Pdis = self.dv_soln['Pdis'].values[:-1].astype('f8')
+			self.timetable['Charge'] = Pch
+			self.timetable['Discharge'] = Pdis
+			self.timetable['Earnings'] = self.timetable['Price'] * (Pdis - Pch) * self.delta_t
+		else:
+			self.timetable = self.timetable.drop(columns=['Charge', 'Discharge', 'Earnings'], errors='ignore')
+
+		columns = [col for col in ('Price', 'Charge', 'Discharge', 'Earnings') if col in self.timetable]
+		grouped = self.timetable.groupby(['month', 'dow', 'hr'])
+
+		self.cube = grouped[columns].sum()
+		self.cube['Count'] = grouped.size()
+		return
+
+
+	def __formulateprob(self):
+		"""Formulates the optimization problem. With options['Model templates'], the variables and constraints are
+		built from the cached template of the horizon and battery specs (see templates.py)."""
+		self.prob = Model(self.name, env=self.env)
+		if self.quiet:
+			self.prob.Params.OutputFlag = 0
+		self._n_fixed = 0
+
+		template = batopt.__get_template(self)
+		if template is not None:
+			batopt.__formulate_fromtemplate(self, template)
+		else:
+			# --------------------------------------------------------------------------- STEP 1: Build dvs
+			with self._phase('variables'):
+				# DV vector table
+				self.dv_vecs = pd.DataFrame(index=range(len(self.prices)+1), columns=['E', 'Pch', 'Pdis', 'b'])
+
+				for dv_type in self.dv_vecs.columns:
+					self.dv_vecs[dv_type] = batopt.__create_DVvec(self, dv_type)
+
+				# Final charge
+				self.dv_vecs.at[self.dv_vecs.index[-1], 'E'] = self.prob.addVar(name="Efin", vtype=GRB.CONTINUOUS,
+				                                                                lb=0,
+				                                                                ub=self.batspecs.at['Capacity [kWh]'])
 
-		for idx, Price in enumerate(self.prices):
-			Pch  = self.dv_vecs.at[idx, 'Pch']
-			Pdis = self.dv_vecs.at[idx, 'Pdis']
 
-			Obj.addTerms([Price * self.delta_t, -Price * self.delta_t], [Pdis, Pch])
+			# --------------------------------------------------------------------------- STEP 2: Build constraints
+			with self._phase('constraints'):
+				batopt.__all_constrs(self)
 
-		self.prob.setObjective(Obj, sense=GRB.MAXIMIZE)
+		# --------------------------------------------------------------------------- STEP 3: Set objective
+		# The only step that depends on the prices
+		with self._phase('objective'):
+			self.prob.update()
+			coeffs = np.asarray(self.prices, dtype='f8') * self.delta_t
+
+			self.prob.setAttr('Obj', list(self.dv_vecs['Pdis'].values[:-1]), coeffs)
+			self.prob.setAttr('Obj', list(self.dv_vecs['Pch'].values[:-1]), -coeffs)
+			self.prob.ModelSense = GRB.MAXIMIZE
+			self.prob.update()
 
 		# --------------------------------------------------------------------------- STEP 4: Report
-		self.prob.update()
-		print("\nProblem formulated")
-		print(self.prob)
+		self._count_model()
+		self._report("\nProblem formulated")
+		self._report(str(self.prob))
+
+		return
+
+
+	def __get_template(self):
+		"""Returns the model template of the horizon and battery specs from templates.cache, or None if model
+		templates are disabled (options['Model templates']), Gurobi is older than 10 or SciPy is not installed."""
+		if not self.options.get('Model templates') or not GUROBI_MATRIX_API:
+			return None
+		try:
+			import templates
+		except ImportError:
+			return None
+
+		with self._phase('template'):
+			template, source = templates.cache.get(len(self.prices), self.delta_t, self.batspecs)
+		self._emit({'event': 'template', 'source': source})
+		logger.debug("Model template: %s. %s", source, templates.cache.report())
+		return template
+
+
+	def __formulate_fromtemplate(self, template):
+		"""Builds the variables and constraints from a model template (see templates.py). self.dv_vecs holds the
+		same Gurobi variables (and names) as when built one by one."""
+		n_steps = len(self.prices)
+
+		with self._phase('variables'):
+			x = self.prob.addMVar(len(template['lb']), lb=template['lb'], ub=template['ub'], vtype=template['vtype'])
+			# np.fromiter: NumPy/pandas otherwise probe each Var as a sequence (slow)
+			dvs = np.fromiter(x.tolist(), dtype=object, count=len(template['lb']))
+
+			# Pch, Pdis and b have no end point (NaN, as when built one by one)
+			columns = ['E', 'Pch', 'Pdis', 'b']
+			table = np.full((n_steps+1, len(columns)), np.nan, dtype=object)
+			for col, dv_type in enumerate(columns):
+				start, stop = template['slices'][dv_type]
+				table[:stop-start, col] = dvs[start:stop]
+
+			self.dv_vecs = pd.DataFrame(table, index=range(n_steps+1), columns=columns)
+
+			# Names as in __create_DVvec() (set in bulk)
+			names = ["{}, {}".format(dv_type, idx) for dv_type in columns
+			         for idx in range(n_steps if dv_type != 'E' else n_steps+1)]
+			names[n_steps] = "Efin"
+			self.prob.setAttr('VarName', list(dvs), names)
+
+		with self._phase('constraints'):
+			constrs = self.prob.addMConstr(template['A'], x, template['sense'], template['rhs']).tolist()
+			# Charge neutrality is the last row (moved by append_prices())
+			self._neutral_constr = constrs[-1]
+
+			# Names as in __all_constrs(); the rows are ordered by constraint type, then time step
+			names = ["({},{})".format(constr, t) for constr in ('ChBal', 'PchBin', 'PdisBin') for t in range(n_steps)]
+			names.append("Charge Neutral")
+			self.prob.setAttr('ConstrName', constrs, names)
 
 		return
 
 
-	def __create_DVvec(self, dv_type):
+	def __create_DVvec(self, dv_type, steps=None):
 		"""Creates the vector optimization variables for the given model, and returns it as a series (same length as
 		self.prices).
 
@@ -493,6 +871,8 @@ class batopt():
 						'Pdis'  discharging power
 						'b'     charge/discharge decision
 
+			steps:      Range of the time steps (defaults to all of self.prices); also the index of the series
+
 		RETURNS
 			Pandas Series of the requested decision variables.
 
@@ -523,11 +903,13 @@ class batopt():
 		# --------------------------------------------------------------------------------- STEP 2 Define dv
 		assert all(attr in prms for attr in ("vtype", "lb", "ub"))
 		# Apart from requiring an explicit parameter setting, this assertion ensures proper control flow in the body.
-		return pd.Series(data=[self.prob.addVar(name="{}, {}".format(dv_type, idx), **prms)
-		                       for idx in range(len(self.prices))], dtype="object")
+		if steps is None:
+			steps = range(len(self.prices))
+		return pd.Series(data=[self.prob.addVar(name="{}, {}".format(dv_type, idx), **prms) for idx in steps],
+		                 index=steps, dtype="object")
 
 
-	def __all_constrs(self):
+	def __all_constrs(self, steps=None):
 		"""
 		Applies the ff. constraints to the model:
 			- battery charge balance (linear)
@@ -538,6 +920,8 @@ class batopt():
 			model:      Gurobi model
 			dv_vecs:    DataFrame of all vector decision variables (E, Pch, Pdis, b)
 			dv_Efin:    Final battery charge dv
+			steps:      Range of the time steps to constrain (defaults to all). The charge neutrality constraint
+						is (re)placed at the end of self.dv_vecs.
 
 		RETURNS:
 			None
@@ -549,31 +933,37 @@ class batopt():
 		eff_dis = eff_ch
 
 		# Updated -- loops only until the 2nd to the last timestamp
-		for idx, t in enumerate(self.dv_vecs.index[0:-1]):
+		if steps is None:
+			steps = self.dv_vecs.index[0:-1]
+
+		for t in steps:
 			# -------------------------------------------------------------- Step 1 Fetch dvs for time t
 			Et   = self.dv_vecs.at[t, 'E']
-			Et_next = self.dv_vecs.at[self.dv_vecs.index[idx + 1], 'E']
+			Et_next = self.dv_vecs.at[t + 1, 'E']
 			Pch  = self.dv_vecs.at[t, 'Pch']
 			Pdis = self.dv_vecs.at[t, 'Pdis']
 			b    = self.dv_vecs.at[t, 'b']
 
 			# -------------------------------------------------- a) Charge Balance
 			self.prob.addLConstr(Et_next == Et + (eff_ch*Pch - Pdis/eff_dis)*self.delta_t,
-			                 name="(ChBal,{})".format(idx))
+			                 name="(ChBal,{})".format(t))
 
 			# -------------------------------------------------- b) Pch and binary
 			self.prob.addLConstr(Pch/Pmax + (1-b) <= 1,
-			                 name="(PchBin,{})".format(idx))
+			                 name="(PchBin,{})".format(t))
 
 			# -------------------------------------------------- c) Pdis and binary
 			self.prob.addLConstr(Pdis / Pmax + b <= 1,
-			                 name="(PdisBin,{})".format(idx))
+			                 name="(PdisBin,{})".format(t))
 
 		# Not part of loop!
 		# --------------------------------------- d) Final charge = starting charge
 		Estart = self.dv_vecs.at[self.dv_vecs.index[0], 'E']
 		Efin   = self.dv_vecs.at[self.dv_vecs.index[-1], 'E']
-		self.prob.addLConstr(Efin == Estart, name="Charge Neutral")
+		if self.dv_vecs.index[0] < steps[0]:
+			# Extension (see append_prices()): the constraint moves to the new end
+			self.prob.remove(self._neutral_constr)
+		self._neutral_constr = self.prob.addLConstr(Efin == Estart, name="Charge Neutral")
 
 		return
 
@@ -582,7 +972,12 @@ class batopt():
 		"""Calculates self.earnings post-solution."""
 		self.earnings = pd.Series(data=0.0, index=self.dv_vecs.index, dtype='f8')
 
-		for idx in range(len(self.prices)):
+		# Steps fixed by append_prices() keep their earnings
+		n_kept = self._kept_soln[0] if self._kept_soln else 0
+		if self._kept_soln:
+			self.earnings.iloc[:n_kept+1] = self._kept_soln[2].values
+
+		for idx in range(n_kept, len(self.prices)):
 			price = self.prices[idx]
 			Pch = self.dv_soln.at[idx, 'Pch']
 			Pdis = self.dv_soln.at[idx, 'Pdis']
@@ -647,6 +1042,99 @@ class batopt():
 		return self.market_time.GMT_toMarket(GMT)
 
 
+def _plotting():
+	"""Imports (once) and returns matplotlib.pyplot and seaborn. Deferred to the first plot, so that importing batopt
+	(e.g. in worker processes) does not load the plotting libraries."""
+	global _plt, _sns
+	if _plt is None:
+		import matplotlib.pyplot as plt
+		import seaborn as sns
+		sns.set_style("whitegrid")
+		_plt, _sns = plt, sns
+
+	return _plt, _sns
+
+_plt, _sns = None, None
+
+
+def get_BatteryDefns():
+	"""Returns the battery definitions table, loading Input/BatteryDefns.pkl on the first call. The same DataFrame is
+	returned afterwards, so columns added to it (new battery models) persist."""
+	global _BatteryDefns
+	with _BatteryDefns_lock:
+		if _BatteryDefns is None:
+			_BatteryDefns = pd.read_pickle("{}//Input//BatteryDefns.pkl".format(PathProj))
+	return _BatteryDefns
+
+_BatteryDefns = None
+_BatteryDefns_lock = threading.Lock()
+
+
+# Rows of BatteryDefns used by the model
+spec_rows = ['Capacity [kWh]', 'Power [kW]', 'DoD [%]', 'Cycle Efficiency [%]']
+
+
+def get_batspecs(model):
+	"""Returns the specs of model: the name of a column of BatteryDefns (or a list of names, as a DataFrame), or the
+	specs themselves as a Series/DataFrame/dict with the rows of BatteryDefns."""
+	if isinstance(model, dict):
+		model = pd.Series(model, dtype='f8')
+
+	if isinstance(model, (pd.Series, pd.DataFrame)):
+		missing = [row for row in spec_rows if row not in model.index]
+		if missing:
+			raise ValueError("Battery specs are missing {}.".format(", ".join(missing)))
+		return model.copy()
+
+	# A copy, so that instances never share (or change) the table's data
+	return get_BatteryDefns()[model].copy()
+
+
+def __getattr__(name):
+	# Lazy module attribute (PEP 562)
+	if name == 'BatteryDefns':
+		return get_BatteryDefns()
+	raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def get_executor(max_workers=None):
+	"""Returns the thread pool of the async API (batopt.solve_async(), solve_async()). It is created on the first call,
+	with max_workers threads (defaults to os.cpu_count()); solves beyond max_workers are queued."""
+	global _executor
+	with _executor_lock:
+		if _executor is None:
+			_executor = ThreadPoolExecutor(max_workers=max_workers or os.cpu_count() or 1,
+			                               thread_name_prefix='batopt')
+	return _executor
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _setup(model, prices, start_time, market_time, name, env):
+	"""Creates a quiet batopt on its own Gurobi environment (unless env is passed), and sets the prices."""
+	if env is None:
+		env = Env(empty=True)
+		env.setParam('OutputFlag', 0)
+		env.start()
+
+	battery = batopt(model, name=name, quiet=True, env=env)
+	battery.set_prices(prices, start_time=start_time, market_time=market_time)
+	return battery
+
+
+async def solve_async(model, prices, start_time, market_time=CA_time, name='Bat 1', env=None, calc_stats=True,
+                      executor=None):
+	"""Values a battery without blocking the event loop: creates the batopt, sets the prices and solves it in
+	executor (defaults to get_executor()), and returns the batopt. Arguments are as in batopt() and
+	batopt.set_prices(). Unless env is passed, each call gets its own Gurobi environment, so that calls can run
+	concurrently. Cancelling the awaiting task aborts the solve (see batopt.solve_async())."""
+	executor = executor or get_executor()
+	battery = await asyncio.wrap_future(executor.submit(_setup, model, prices, start_time, market_time, name, env))
+	await battery.solve_async(calc_stats=calc_stats, executor=executor)
+	return battery
+
+
 class batoptError(Exception):
 	"""Base exception for batopt"""
 	pass
@@ -657,6 +1145,38 @@ class OutsideTimeRange(batoptError):
 	pass
 
 
+def calc_opstats(prices, Pch, Pdis, fullmonths, delta_t):
+	"""Returns the operation statistics (see batopt.calc_stats()) of the dispatch Pch, Pdis (arrays of the same
+	length as prices), per FULL month in fullmonths ({mm: (start_idx, end_idx)}) and 'Overall'."""
+	multp = 10**-3 # kWh to MWh conversion
+
+	prices = np.asarray(prices, dtype='f8')
+	Pch = np.asarray(Pch, dtype='f8')
+	Pdis = np.asarray(Pdis, dtype='f8')
+
+	# Month ends are inclusive
+	periods = [(mt.month_abrv[mm], start_idx, end_idx+1) for mm, (start_idx, end_idx) in fullmonths.items()]
+	periods.append(('Overall', 0, len(prices)))
+
+	stats = pd.DataFrame(index=[mmm for mmm, _, _ in periods],
+	                     columns=['Energy Consumed', 'Energy Released', 'Energy Lost', 'Energy Revenue',
+	                              'Energy Costs', 'Net Earnings'], dtype='f8')
+
+	for mmm, start, stop in periods:
+		# ENERGY
+		stats.at[mmm, 'Energy Consumed'] = Pch[start:stop].sum()*delta_t*multp
+		stats.at[mmm, 'Energy Released'] = Pdis[start:stop].sum()*delta_t*multp
+
+		# CASH
+		stats.at[mmm, 'Energy Revenue'] = round((prices[start:stop]*Pdis[start:stop]).sum()*delta_t, 2)
+		stats.at[mmm, 'Energy Costs'] = round((prices[start:stop]*Pch[start:stop]).sum()*delta_t, 2)
+
+	stats['Energy Lost'] = stats['Energy Consumed'] - stats['Energy Released']
+	stats['Net Earnings'] = stats['Energy Revenue'] - stats['Energy Costs']
+
+	return stats
+
+
 def simple_payback(Rev_energy, Rev_AS, Cost_energy, Battery_kWh, i=0.05, USD_perkWh = 180, percent_storage_costs=80):
 	"""Simple cashflow calculation to compute the payback period (i.e. whole years until project has a positive net
 	value.
@@ -674,31 +1194,39 @@ def simple_payback(Rev_energy, Rev_AS, Cost_energy, Battery_kWh, i=0.05, USD_per
 		Yearly Income = Rev_energy + Rev_AS - Cost_energy
 
 		Rev_energy      Yearly revenue from energy arbitrage
-		Rev_AS          Yearly revenue from all ancillary services (for simplicity, express as a multiple of Rev_energy)
+		Rev_AS          Yearly revenue from all ancillary services (for simplicity, express as a multiple of
+						Rev_energy)
 
 
 	Returns:
 		Numpy array tracking the net present value, until the year the present value becomes positive. The payback
 		period is one less the length of this array.
 
+	Use finance.evaluate() to compute whole arrays of cases at once (in closed form, without the yearly rounding of the
+	account).
+
 	"""
 	YearlyIncome = Rev_energy + Rev_AS - Cost_energy
 
-	Principal = Battery_kWh * USD_perkWh * (100 / percent_storage_costs)
+	Principal = float(finance.principal(Battery_kWh, USD_perkWh=USD_perkWh,
+	                                    percent_storage_costs=percent_storage_costs))
 
 	if i * Principal > YearlyIncome:
 		raise RuntimeError("The yearly income cannot cover the cost of capital.")
 
-	Account = np.array([-Principal], dtype='f8')
+	# The account is rounded to cents every year, over at most 50 years
+	Account = [-Principal]
 
 	for yr in range(50):
 		if Account[yr] >= 0:
 			break
-		Account = np.append(Account, round(Account[yr] * (1 + i) + YearlyIncome, 2))
+		Account.append(round(Account[yr] * (1 + i) + YearlyIncome, 2))
 		yr += 1
 	else:
 		raise RuntimeError("Project did not break-even in {} years".format(yr))
 
+	Account = np.array(Account, dtype='f8')
+
 	print("Payback period: {} yrs".format(yr))
 
 	return Account
\ No newline at end of file
@@ -0,0 +1,2 @@
+"""Benchmarks of batopt's formulation, solve, solution extraction, reporting and market time conversions, on
+synthetic prices (benchmarks.prices). Run with python -m benchmarks.run (see benchmarks/run.py)."""
@@ -0,0 +1,91 @@
+"""Synthetic price vectors and market times for the benchmarks.
+
+Prices are in USD/kWh (as Input/CAISO_prices_2018.pkl), starting at H01 of Jan 1 of the start year.
+
+	daily_shape()           Two-peak daily profile (morning and evening) with seasonal swing and noise
+	negative_episodes()     Adds midday episodes of negative prices (e.g. solar oversupply) to a price vector
+	horizons                Benchmark horizons in days, from one week to ten years
+	market_time()           CAISO market time at GMT-8, with the US DST rule applied over the benchmark years
+
+"""
+import datetime
+
+import numpy as np
+
+import markettime as mt
+
+# Horizons in days
+horizons = {
+	'1w': 7,
+	'1m': 30,
+	'3m': 91,
+	'1y': 365,
+	'10y': 3652,
+}
+
+
+def daily_shape(n_days, steps_per_hour=1, base=0.035, amplitude=0.015, noise=0.004, seed=0):
+	"""Returns n_days*24*steps_per_hour prices with a two-peak daily profile, a seasonal swing and Gaussian noise.
+
+	ARGUMENTS:
+		n_days          Number of days
+
+		steps_per_hour  Time steps per hour (1 for hourly, 4 for 15-min prices)
+
+		base            Average price
+
+		amplitude       Amplitude of the daily profile
+
+		noise           Standard deviation of the noise
+
+		seed            Seed of the random generator
+	"""
+	rng = np.random.default_rng(seed)
+	n_steps = n_days * 24 * steps_per_hour
+	hr = np.arange(n_steps) / steps_per_hour                    # Hours since the start
+
+	hr_of_day = hr % 24
+	# Morning (H08) and evening (H19) peaks, midday dip
+	daily = 0.4*np.exp(-0.5*((hr_of_day - 7.5)/2)**2) + np.exp(-0.5*((hr_of_day - 18.5)/2.5)**2) - 0.3
+	seasonal = 1 + 0.3*np.cos(2*np.pi*hr/(24*365.25))
+
+	return base*seasonal + amplitude*daily + rng.normal(0, noise, n_steps)
+
+
+def negative_episodes(prices, steps_per_hour=1, rate=0.05, depth=0.02, seed=0):
+	"""Returns a copy of prices where a fraction rate of the days have a negative price episode over midday
+	(H11-H15), down to -depth."""
+	rng = np.random.default_rng(seed)
+	prices = np.array(prices, dtype='f8')
+
+	steps_per_day = 24 * steps_per_hour
+	n_days = len(prices) // steps_per_day
+	days = np.flatnonzero(rng.random(n_days) < rate)
+
+	episode = np.arange(10*steps_per_hour, 15*steps_per_hour)
+	for day in days:
+		idx = day*steps_per_day + episode
+		prices[idx] = -depth * rng.uniform(0.2, 1, len(idx))
+
+	return prices
+
+
+def us_dst_periods(years):
+	"""Returns the DST_periods argument of markettime.CAISO for the US rule at GMT-8: from the second Sunday of
+	March (GMT H10) to the first Sunday of November (GMT H09)."""
+	periods = {}
+	for yr in years:
+		mar = datetime.date(yr, 3, 1)
+		start = mar + datetime.timedelta(days=(6 - mar.weekday()) % 7 + 7)
+		nov = datetime.date(yr, 11, 1)
+		end = nov + datetime.timedelta(days=(6 - nov.weekday()) % 7)
+
+		periods[yr] = (start.strftime('%b %d, %Y H10'), end.strftime('%b %d, %Y H09'))
+
+	return periods
+
+
+def market_time(start_year, n_years=11, steps_per_hour=1):
+	"""CAISO market time (GMT-8) with DST defined from start_year over n_years, at the given resolution."""
+	return mt.CAISO(GMToffset=-8, DST_periods=us_dst_periods(range(start_year, start_year+n_years)),
+	                delta_t=1/steps_per_hour)
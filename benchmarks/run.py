@@ -0,0 +1,257 @@
+"""Runs the batopt benchmarks and compares them against a stored baseline.
+
+Every (case, horizon) pair runs the batopt pipeline once, timing each phase separately:
+
+	set_prices          Binding the prices and time (full months, time table), without the formulation
+	formulate           batopt.__formulateprob(), also split by batopt's instrumentation into:
+	  template, variables, constraints, objective       (template: lookup in templates.cache, if enabled)
+	optimize            Gurobi's optimize()
+	extraction          Solution extraction in batopt.solve() (batopt's own timing, without the optimize call)
+	earnings            Earnings and analytics cube in batopt.solve() (batopt's own timing)
+	stats               batopt.calc_stats()
+	GMT_toMarket        Conversion of every time step to market time
+	Market_toGMT        Conversion back to GMT
+	market_range        Generation of the same time stamps by market-hour stepping (hourly cases only)
+
+The startup cost of a worker process is measured as case 'startup': the wall time of importing batopt in a fresh
+interpreter (best of 3), before and after loading the battery definitions.
+
+Peak memory per phase is the peak of the Python allocations (tracemalloc); Gurobi's own memory is not included, but
+the process peak RSS is recorded at the end of the run. If optimize fails (e.g. with a size-limited Gurobi license),
+the phases that need a solution are skipped and the error is recorded.
+
+Usage (from the project directory):
+
+	python -m benchmarks.run --out benchmarks/baseline.json             (first, to store the baseline)
+	python -m benchmarks.run --out bench.json --baseline benchmarks/baseline.json
+	python -m benchmarks.run --horizons 1w 1m --out bench.json
+
+Timings are only comparable on the same machine (and Gurobi license), so no baseline is shipped: store one on the
+machine that runs the comparisons (its 'meta' records the machine and library versions). The exit code is 1 if any
+phase regressed against the baseline, and 2 if the baseline file does not exist.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import gurobipy
+
+import batopt as bo
+from benchmarks import prices as bp
+
+# Cases: (steps per hour, price generator)
+cases = {
+	'daily': (1, lambda n_days, sph: bp.daily_shape(n_days, sph)),
+	'negative': (1, lambda n_days, sph: bp.negative_episodes(bp.daily_shape(n_days, sph), sph, rate=0.1)),
+	'subhourly': (4, lambda n_days, sph: bp.daily_shape(n_days, sph)),
+}
+
+start_year = 2018
+
+
+class _Recorder():
+	"""Times phases (and traces their peak Python memory if trace_memory), and collects the results."""
+
+	def __init__(self, case, horizon, n_steps, trace_memory=True):
+		self.case = case
+		self.horizon = horizon
+		self.n_steps = n_steps
+		self.trace_memory = trace_memory
+		self.results = []
+
+
+	def measure(self, phase, func, *args):
+		"""Runs func(*args) as the given phase, and returns its result."""
+		if self.trace_memory:
+			tracemalloc.start()
+
+		peak_mb = None
+		try:
+			start = time.perf_counter()
+			out = func(*args)
+			seconds = time.perf_counter() - start
+
+			if self.trace_memory:
+				peak_mb = tracemalloc.get_traced_memory()[1] / 2**20
+		finally:
+			if self.trace_memory:
+				tracemalloc.stop()
+
+		self.results.append({'case': self.case, 'horizon': self.horizon, 'n_steps': self.n_steps, 'phase': phase,
+		                     'seconds': seconds, 'peak_mb': peak_mb})
+		return out
+
+
+	def record(self, phase, seconds):
+		"""Records a phase timed elsewhere (e.g. by batopt's instrumentation), without memory."""
+		self.results.append({'case': self.case, 'horizon': self.horizon, 'n_steps': self.n_steps, 'phase': phase,
+		                     'seconds': seconds, 'peak_mb': None})
+		return
+
+
+	def skip(self, phase, reason):
+		self.results.append({'case': self.case, 'horizon': self.horizon, 'n_steps': self.n_steps, 'phase': phase,
+		                     'seconds': None, 'peak_mb': None, 'skipped': reason})
+		return
+
+
+def run_case(case, horizon, model='Tesla Powerpack', trace_memory=True):
+	"""Runs the pipeline on one (case, horizon) pair, and returns the list of phase results."""
+	steps_per_hour, generator = cases[case]
+	n_days = bp.horizons[horizon]
+	n_years = n_days // 365 + 2
+
+	prices = generator(n_days, steps_per_hour)
+	market_time = bp.market_time(start_year, n_years, steps_per_hour)
+	rec = _Recorder(case, horizon, len(prices), trace_memory)
+
+	battery = bo.batopt(model, name='Benchmark', quiet=True)
+
+	rec.measure('set_prices', battery.set_prices, prices, ("01/01/{}".format(start_year), 1), market_time, False)
+	rec.measure('formulate', battery._batopt__formulateprob)
+
+	try:
+		rec.measure('optimize', battery.prob.optimize)
+		reason = "Not solved to optimality (status {})".format(battery.prob.status)
+	except gurobipy.GurobiError as err:
+		reason = str(err)
+		rec.skip('optimize', reason)
+
+	if battery.prob.status == 2:
+		# solve() re-runs optimize() (immediate on a solved model); its phases are taken from batopt's timings
+		battery.solve(False)
+		rec.record('extraction', battery.timings['extraction'])
+		rec.record('earnings', battery.timings['earnings'])
+		rec.measure('stats', battery.calc_stats)
+	else:
+		for phase in ('extraction', 'earnings', 'stats'):
+			rec.skip(phase, reason)
+
+	# batopt's own timings of the formulation steps (see batopt's INSTRUMENTATION)
+	for phase in ('template', 'variables', 'constraints', 'objective'):
+		rec.record(phase, battery.timings.get(phase))
+
+	# ------------------------------------------------------------------- Market time conversions
+	GMTs = [battery.start_time + idx*market_time.delta_t for idx in range(len(prices))]
+	stamps = rec.measure('GMT_toMarket', lambda: [market_time.GMT_toMarket(GMT) for GMT in GMTs])
+	rec.measure('Market_toGMT', lambda: [market_time.Market_toGMT(ts) for ts in stamps])
+	if steps_per_hour == 1:
+		rec.measure('market_range', market_time.market_range, stamps[0], len(stamps))
+
+	battery.prob.dispose()
+	return rec.results
+
+
+def run_startup(repeat=3):
+	"""Times the import of batopt in fresh interpreters (best of repeat), and returns the phase results."""
+	scripts = {
+		'import': "import batopt",
+		'import+specs': "import batopt; batopt.get_batspecs('Tesla Powerpack')",
+	}
+	timer = ("import time, sys; start = time.perf_counter(); exec(sys.argv[1]); "
+	         "print(time.perf_counter() - start)")
+
+	results = []
+	for phase, script in scripts.items():
+		seconds = min(float(subprocess.run([sys.executable, '-c', timer, script], capture_output=True, text=True,
+		                                   check=True).stdout)
+		              for _ in range(repeat))
+		results.append({'case': 'startup', 'horizon': '-', 'n_steps': 0, 'phase': phase, 'seconds': seconds,
+		                'peak_mb': None})
+	return results
+
+
+def compare(results, baseline, tolerance=0.25, min_seconds=0.005):
+	"""Returns the phases of results that are slower than in baseline by more than tolerance (relative) and
+	min_seconds (absolute), as a list of (case, horizon, phase, baseline seconds, seconds)."""
+	base = {(res['case'], res['horizon'], res['phase']): res['seconds'] for res in baseline['results']
+	        if res.get('seconds') is not None}
+
+	regressions = []
+	for res in results['results']:
+		key = (res['case'], res['horizon'], res['phase'])
+		if res.get('seconds') is None or key not in base:
+			continue
+		if res['seconds'] > base[key]*(1 + tolerance) and res['seconds'] - base[key] > min_seconds:
+			regressions.append(key + (base[key], res['seconds']))
+
+	return regressions
+
+
+def run(case_names, horizon_names, trace_memory=True):
+	"""Runs the benchmarks, and returns the results (as saved to the JSON file)."""
+	results = run_startup()
+	for case in case_names:
+		for horizon in horizon_names:
+			print("{:>10} {:>4} ...".format(case, horizon), end=' ', flush=True)
+			start = time.perf_counter()
+			results.extend(run_case(case, horizon, trace_memory=trace_memory))
+			print("{:0.2f} s".format(time.perf_counter() - start))
+
+	return {
+		'meta': {
+			'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+			'python': platform.python_version(),
+			'platform': platform.platform(),
+			'processor': platform.processor() or platform.machine(),
+			'cpu_count': os.cpu_count(),
+			'numpy': np.__version__,
+			'pandas': pd.__version__,
+			'gurobi': '.'.join(str(num) for num in gurobipy.gurobi.version()),
+			'trace_memory': trace_memory,
+			# Linux reports KiB
+			'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10,
+		},
+		'results': results,
+	}
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="batopt benchmarks")
+	parser.add_argument('--cases', nargs='+', default=list(cases), choices=list(cases))
+	parser.add_argument('--horizons', nargs='+', default=['1w', '1m'], choices=list(bp.horizons))
+	parser.add_argument('--out', default='bench.json', help="Results file (JSON)")
+	parser.add_argument('--baseline', default=None, help="Baseline results file to compare against")
+	parser.add_argument('--tolerance', type=float, default=0.25, help="Allowed relative slow-down")
+	parser.add_argument('--no-memory', action='store_true', help="Do not trace memory (cleaner timings)")
+	args = parser.parse_args(argv)
+
+	if args.baseline and not os.path.exists(args.baseline):
+		print("Baseline {} not found. Generate one first, on this machine: "
+		      "python -m benchmarks.run --out {}".format(args.baseline, args.baseline))
+		return 2
+
+	results = run(args.cases, args.horizons, trace_memory=not args.no_memory)
+	with open(args.out, 'w') as f:
+		json.dump(results, f, indent=1)
+
+	# ------------------------------------------------------------------- Report
+	table = pd.DataFrame(results['results'])
+	print(table.pivot_table(index=['case', 'horizon'], columns='phase', values='seconds', sort=False).round(4)
+	      .to_string())
+
+	if args.baseline:
+		with open(args.baseline) as f:
+			baseline = json.load(f)
+
+		regressions = compare(results, baseline, tolerance=args.tolerance)
+		for case, horizon, phase, before, after in regressions:
+			print("REGRESSION {} {} {}: {:0.4f} s -> {:0.4f} s".format(case, horizon, phase, before, after))
+		if regressions:
+			return 1
+		print("No regressions against {}".format(args.baseline))
+
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,145 @@
+"""Vectorized financial analysis of battery projects.
+
+The cash flow model is that of batopt.simple_payback(), evaluated in closed form so that whole arrays of cases are
+computed at once (e.g. a Monte Carlo over revenues, interest rates and battery costs):
+
+	Principal       = Battery_kWh * USD_perkWh * (100/percent_storage_costs)
+	Yearly Income   = Rev_energy + Rev_AS - Cost_energy         (fixed over the years)
+
+	Account(n)      = Account(n-1)*(1+i) + Yearly Income,  Account(0) = -Principal
+	                = -Principal*(1+i)**n + Yearly Income*((1+i)**n - 1)/i
+
+	NPV(n)          = Account(n) / (1+i)**n
+
+All arguments of the functions below are broadcast against each other (scalars or NumPy arrays of any shape). Results
+are returned as NumPy structured arrays of the broadcast shape.
+
+	evaluate()          Principal, yearly income, payback year, NPV and IRR over the horizon
+	trajectories()      Account (or NPV) per year, for plotting a limited number of cases
+	payback_year()      Whole years until the account becomes non-negative
+	irr()               Internal rate of return of the project over the horizon
+
+"""
+import numpy as np
+
+# Result layout of evaluate()
+result_dtype = np.dtype([
+	('Principal', 'f8'),
+	('Income', 'f8'),
+	('Payback', 'i4'),          # Whole years; -1 if the project does not break even within the horizon
+	('NPV', 'f8'),              # NPV at the end of the horizon
+	('IRR', 'f8'),              # Over the horizon; NaN if undefined
+])
+
+
+def principal(Battery_kWh, USD_perkWh=180, percent_storage_costs=80):
+	"""Initial investment. The storage (battery) costs are percent_storage_costs of the total."""
+	return np.asarray(Battery_kWh, dtype='f8') * USD_perkWh * (100 / np.asarray(percent_storage_costs, dtype='f8'))
+
+
+def _growth_sum(i, n):
+	"""Returns ((1+i)**n - 1)/i, with its limit n at i=0."""
+	i, n = np.broadcast_arrays(np.asarray(i, dtype='f8'), np.asarray(n, dtype='f8'))
+	out = n.copy()
+	nz = i != 0
+	out[nz] = np.expm1(n[nz] * np.log1p(i[nz])) / i[nz]
+	return out
+
+
+def account(Principal, Income, i, n):
+	"""Account value after n years (see module docstring)."""
+	return -Principal * (1 + np.asarray(i, dtype='f8'))**n + Income * _growth_sum(i, n)
+
+
+def payback_year(Principal, Income, i=0.05, horizon=50):
+	"""Returns the whole years until the account becomes non-negative (0 if Principal <= 0), or -1 if the project
+	does not break even within the horizon (including when the yearly income cannot cover the cost of capital)."""
+	Principal, Income, i = np.broadcast_arrays(np.asarray(Principal, dtype='f8'), np.asarray(Income, dtype='f8'),
+	                                           np.asarray(i, dtype='f8'))
+	years = np.full(Principal.shape, -1, dtype='i4')
+
+	# Solve (1+i)**n >= Income/(Income - i*Principal) for the smallest n. At i=0, n >= Principal/Income.
+	covers = Income > i * Principal
+	with np.errstate(divide='ignore', invalid='ignore'):
+		n_exact = np.where(i != 0,
+		                   np.log(Income / (Income - i * Principal)) / np.log1p(i),
+		                   Principal / Income)
+	n = np.ceil(np.where(covers, n_exact, 0))
+
+	# Guard against round-off at the integer boundary
+	n = np.where(covers & (n > 0) & (account(Principal, Income, i, np.maximum(n-1, 0)) >= 0), n-1, n)
+	n = np.where(covers & (account(Principal, Income, i, n) < 0), n+1, n)
+
+	ok = covers & (n <= horizon)
+	years[ok] = n[ok]
+	years[Principal <= 0] = 0
+
+	return years
+
+
+def irr(Principal, Income, horizon=50, tol=1e-10, maxiter=200):
+	"""Internal rate of return r of the cash flows (-Principal; Income for years 1..horizon), i.e. the root of
+	Income*(1 - (1+r)**-horizon)/r = Principal. Solved by vectorized bisection on (-1, 100). NaN where undefined
+	(non-positive Principal or Income)."""
+	Principal, Income, horizon = np.broadcast_arrays(np.asarray(Principal, dtype='f8'),
+	                                                 np.asarray(Income, dtype='f8'),
+	                                                 np.asarray(horizon, dtype='f8'))
+	valid = (Principal > 0) & (Income > 0)
+
+	lo = np.full(Principal.shape, -1 + 1e-9)
+	hi = np.full(Principal.shape, 100.0)
+
+	def excess(r):
+		# PV of the income minus the principal; decreasing in r
+		with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+			disc = np.exp(-horizon * np.log1p(r))
+			annuity = np.where(np.abs(r) > 1e-12, (1 - disc) / np.where(r == 0, 1, r), horizon)
+			return Income * annuity - Principal
+
+	for _ in range(maxiter):
+		mid = (lo + hi) / 2
+		pos = excess(mid) > 0
+		lo = np.where(pos, mid, lo)
+		hi = np.where(pos, hi, mid)
+		if np.all(hi - lo < tol):
+			break
+
+	# Roots on the bracket ends are not roots
+	return np.where(~valid | (excess(hi) > 0) | (excess(lo) < 0), np.nan, (lo + hi) / 2)
+
+
+def evaluate(Rev_energy, Rev_AS, Cost_energy, Battery_kWh, i=0.05, USD_perkWh=180, percent_storage_costs=80,
+             horizon=50):
+	"""Evaluates the cases defined by the (broadcast) arguments. Arguments are as in batopt.simple_payback().
+
+	RETURNS:
+		Structured array (dtype finance.result_dtype) with the broadcast shape of the arguments.
+	"""
+	Income = np.asarray(Rev_energy, dtype='f8') + Rev_AS - Cost_energy
+	P = principal(Battery_kWh, USD_perkWh, percent_storage_costs)
+	P, Income, i = np.broadcast_arrays(P, Income, np.asarray(i, dtype='f8'))
+
+	out = np.empty(P.shape, dtype=result_dtype)
+	out['Principal'] = P
+	out['Income'] = Income
+	out['Payback'] = payback_year(P, Income, i, horizon)
+	out['NPV'] = account(P, Income, i, horizon) / (1 + i)**horizon
+	out['IRR'] = irr(P, Income, horizon)
+
+	return out
+
+
+def trajectories(Rev_energy, Rev_AS, Cost_energy, Battery_kWh, i=0.05, USD_perkWh=180, percent_storage_costs=80,
+                 horizon=50, discount=False):
+	"""Returns the account value for the years 0..horizon (or the NPV, if discount), as an array of the broadcast
+	shape of the arguments plus a trailing axis of length horizon+1."""
+	Income = np.asarray(Rev_energy, dtype='f8') + Rev_AS - Cost_energy
+	P = principal(Battery_kWh, USD_perkWh, percent_storage_costs)
+	P, Income, i = np.broadcast_arrays(P, Income, np.asarray(i, dtype='f8'))
+
+	n = np.arange(horizon + 1, dtype='f8')
+	values = account(P[..., None], Income[..., None], i[..., None], n)
+
+	if discount:
+		values = values / (1 + i[..., None])**n
+	return values
@@ -10,8 +10,17 @@ These formats must provide at least the ff:
 
 The time formats should implement DST as necessary, to comply with actual standards.
 
+CAISO TimeStamps are immutable, hashable and ordered (usable as dict and sort keys). Stepping by market hours depends
+on the DST days of a jurisdiction, and is implemented by CAISO instances:
+
+	day_hours(date)         Market hours of a date, in chronological order (23 or 25 on the DST switch days)
+	shift(ts, n)            TimeStamp n market hours after ts (before, if n < 0)
+	market_range(ts, n)     List of the n TimeStamps starting at ts
+
+
 """
 import datetime
+import functools
 
 class MarkettimeError(Exception):
 	"""Base exception for markettime.py errors."""
@@ -23,6 +32,8 @@ class UndefinedDST(MarkettimeError):
 	pass
 
 delta_hr = datetime.timedelta(hours=1)
+_one_day = datetime.timedelta(days=1)
+_regular_day = tuple(range(1, 25))
 
 month_abrv = {
 	1: 'Jan',
@@ -73,12 +84,15 @@ class CAISO():
 	"""Implements the CAISO market time format. Instances implement the market time at a given jurisdiction (as a GMT
 	offset)"""
 
+	@functools.total_ordering
 	class TimeStamp():
-		"""Market time stamp. Instances are NOT tied to CAISO instances."""
+		"""Market time stamp. Instances are NOT tied to CAISO instances.
+
+		Time stamps are immutable, hashable and ordered. The order is chronological: H25 (the repeated hour on the
+		switch back to winter time) falls between H02 and H03 of its day."""
 		# TODO - The TimeStamp class of the various formats should be standardized
 		# (just as the methods GMT_toMarket, Market_toGMT are)
-		# TODO - On second thought, should have ridden on the datetime.datetime class instead
-		# so that the class methods can be used (e.g. add one day)
+		__slots__ = ('dt', 'hr')
 
 		def __init__(self, dt: datetime.date, hr: int):
 			if not isinstance(dt, datetime.date):
@@ -93,18 +107,69 @@ class CAISO():
 				raise ValueError("Market hr must be an integer from 1-25.")
 
 			# date object
-			self.dt = datetime.date(year=dt.year, month=dt.month, day=dt.day)
+			object.__setattr__(self, 'dt', datetime.date(year=dt.year, month=dt.month, day=dt.day))
 			# market hour
-			self.hr = hr
-
-			# Convenience
-			self.year = dt.year
-			self.month = dt.month
-			self.day = dt.day
+			object.__setattr__(self, 'hr', hr)
 
 			return
 
 
+		@classmethod
+		def _trusted(cls, dt: datetime.date, hr: int):
+			"""Constructor without validation, for the bulk generation of known-valid time stamps."""
+			self = object.__new__(cls)
+			object.__setattr__(self, 'dt', dt)
+			object.__setattr__(self, 'hr', hr)
+			return self
+
+
+		# Convenience
+		@property
+		def year(self):
+			return self.dt.year
+
+		@property
+		def month(self):
+			return self.dt.month
+
+		@property
+		def day(self):
+			return self.dt.day
+
+
+		def __setattr__(self, name, value):
+			raise AttributeError("TimeStamp instances are immutable.")
+
+
+		def __delattr__(self, name):
+			raise AttributeError("TimeStamp instances are immutable.")
+
+
+		def __reduce__(self):
+			return (CAISO.TimeStamp, (self.dt, self.hr))
+
+
+		def _key(self):
+			# H25 repeats the hour after H02
+			return (self.dt, 2.5 if self.hr == 25 else self.hr)
+
+
+		def __eq__(self, other):
+			if not isinstance(other, CAISO.TimeStamp):
+				return NotImplemented
+			return self.dt == other.dt and self.hr == other.hr
+
+
+		def __lt__(self, other):
+			if not isinstance(other, CAISO.TimeStamp):
+				return NotImplemented
+			return self._key() < other._key()
+
+
+		def __hash__(self):
+			return hash((self.dt, self.hr))
+
+
 		def __repr__(self):
 			return "{MM}/{DD}/{YYYY} H{HH}".format(MM=str(self.dt.month).zfill(2),
 			                                       DD=str(self.dt.day).zfill(2),
@@ -162,6 +227,9 @@ class CAISO():
 
 		self.delta_t = datetime.timedelta(hours=delta_t)
 
+		# {year: {date: market hours}} of the DST switch days (see day_hours())
+		self._DST_days = {}
+
 		return
 
 
@@ -184,9 +252,90 @@ class CAISO():
 		self.DST_periods.update({yr: (datetime.datetime.strptime(dt_ends[0], '%b %d, %Y H%H'),
 		                              datetime.datetime.strptime(dt_ends[1], '%b %d, %Y H%H'))
 		                         for yr, dt_ends in DST_periods.items()})
+		self._DST_days = {}
 		return
 
 
+	def day_hours(self, dt: datetime.date):
+		"""Returns the market hours of date dt, in chronological order. This is H01-H24, except on the DST switch
+		days: the hour skipped on the switch to summer time (e.g. H03), and H25 after the repeated hour on the switch
+		back to winter time (e.g. H01, H02, H25, H03, ...)."""
+		if not self.ObserveDST:
+			return _regular_day
+
+		if dt.year not in self.DST_periods:
+			raise UndefinedDST("{} is not in self.DST_periods. Pls. include the DST period for this "
+			                   "year.".format(dt.year))
+
+		if dt.year not in self._DST_days:
+			DST_start, DST_end = self.DST_periods[dt.year]
+			days = {}
+
+			# Summer: the first DST hour follows the hour before it by 2 market hours
+			first_DST = self.GMT_toMarket(DST_start)
+			days[first_DST.dt] = tuple(hr for hr in _regular_day if hr != first_DST.hr - 1)
+
+			# Winter: H25 comes right after the hour preceding the end of DST
+			before_h25 = self.GMT_toMarket(DST_end - delta_hr)
+			hours = list(_regular_day)
+			hours.insert(hours.index(before_h25.hr) + 1, 25)
+			days[before_h25.dt] = tuple(hours)
+
+			# Published whole, so that concurrent threads never see a partial year
+			self._DST_days[dt.year] = days
+
+		return self._DST_days[dt.year].get(datetime.date(dt.year, dt.month, dt.day), _regular_day)
+
+
+	def shift(self, markettime: TimeStamp, n: int):
+		"""Returns the TimeStamp n market hours after markettime (before, if n < 0), following the 23- and 25-hour
+		days. Only hourly market times are supported."""
+		if self.delta_t != delta_hr:
+			raise NotImplementedError("Market hour arithmetic is only implemented for hourly market times.")
+
+		dt = markettime.dt
+		hours = self.day_hours(dt)
+		try:
+			pos = hours.index(markettime.hr) + n
+		except ValueError:
+			raise ValueError("{} is not a market hour of this market time.".format(markettime)) from None
+
+		while pos >= len(hours):
+			pos -= len(hours)
+			dt += _one_day
+			hours = self.day_hours(dt)
+
+		while pos < 0:
+			dt -= _one_day
+			hours = self.day_hours(dt)
+			pos += len(hours)
+
+		return CAISO.TimeStamp(dt, hours[pos])
+
+
+	def market_range(self, start: TimeStamp, n: int):
+		"""Returns the list of the n consecutive TimeStamps starting at start (hourly market times only). Much cheaper
+		than converting every step from GMT."""
+		if self.delta_t != delta_hr:
+			raise NotImplementedError("Market hour arithmetic is only implemented for hourly market times.")
+
+		make = CAISO.TimeStamp._trusted
+		dt = start.dt
+		hours = self.day_hours(dt)
+		try:
+			pos = hours.index(start.hr)
+		except ValueError:
+			raise ValueError("{} is not a market hour of this market time.".format(start)) from None
+
+		stamps = [make(dt, hr) for hr in hours[pos:pos + n]]
+		while len(stamps) < n:
+			dt += _one_day
+			hours = self.day_hours(dt)
+			stamps.extend(make(dt, hr) for hr in hours[:n - len(stamps)])
+
+		return stamps
+
+
 
 	def GMT_toMarket(self, GMT: datetime.datetime):
 		"""Convert a GMT time (datetime.datetime) to the CASIO market time (DST-adjusted if applicable)."""
@@ -0,0 +1,209 @@
+"""Energy arbitrage of a fleet of batteries, as ONE optimization model.
+
+Valuing N batteries with N batopt instances builds N models (each with its own DataFrame of Gurobi variables and its
+own solve). class portfolio instead formulates a single model over the fleet, with the variables and constraints
+built as sparse matrix blocks (N units x T time steps, see templates.fleet_matrices()), so that the formulation time
+scales linearly in N*T.
+
+The units may be any columns of batopt.BatteryDefns (repeats allowed), and are optionally coupled by:
+
+	grid_limit      Shared interconnection limit [kW]: |sum of the units' (Pdis - Pch)| <= grid_limit
+	power_limit     Aggregate power limit [kW]: sum of the units' Pch <= power_limit, and the same for Pdis
+
+"""
+import numpy as np
+import pandas as pd
+from gurobipy import GRB, Model
+
+import batopt as bo
+from templates import fleet_matrices
+
+
+class portfolio(bo.batopt):
+	"""Battery fleet model for energy arbitrage. Prices and time are handled as in batopt (set_prices(),
+	Market_toIdx(), Idx_toMarket()); the model, the solution and the statistics cover all units. Of the plots, only
+	plot_monthprices() (the prices are shared) is supported, and cube_profile() only for the prices.
+
+	SOLUTION
+		self.dv_soln        DataFrame of the solution with columns (unit, dv), dv in ('E', 'Pch', 'Pdis', 'b')
+		self.earnings       DataFrame of cumulative earnings, with a column per unit and 'Aggregate'
+		self.stats          DataFrame of operation statistics (see batopt.calc_stats()), with rows (unit, month) for
+							each unit and for 'Aggregate'
+
+	"""
+	def __init__(self, models, name='Portfolio', unit_names=None, grid_limit=None, power_limit=None, quiet=False,
+	             hooks=(), env=None):
+		"""
+		ARGUMENTS:
+			models          List of battery models (columns of batopt.BatteryDefns), one per unit
+
+			name            Name of the Gurobi model
+
+			unit_names      Names of the units (defaults to the model names, numbered if repeated)
+
+			grid_limit      Shared interconnection limit [kW] (None for no limit)
+
+			power_limit     Aggregate charging/discharging power limit [kW] (None for no limit)
+
+			quiet, hooks    Instrumentation, as in batopt
+
+			env             Gurobi environment, as in batopt
+		"""
+		models = list(models)
+		bo.batopt.__init__(self, models, name=name, quiet=quiet, hooks=hooks, env=env)
+
+		if unit_names is None:
+			unit_names = [model if models.count(model) == 1 else "{} #{}".format(model, models[:idx+1].count(model))
+			              for idx, model in enumerate(models)]
+		if len(set(unit_names)) != len(models):
+			raise ValueError("Pls. pass one unique name per unit.")
+
+		# self.batspecs is a DataFrame here (one column per unit)
+		self.batspecs.columns = unit_names
+		self.units = list(unit_names)
+
+		self.grid_limit = grid_limit
+		self.power_limit = power_limit
+		return
+
+
+	def set_prices(self, prices, start_time, market_time):
+		"""Sets the prices (shared by all units) and formulates the fleet model. Arguments are as in
+		batopt.set_prices()."""
+		bo.batopt.set_prices(self, prices, start_time, market_time, formulate=False)
+		self.__formulateprob()
+		return
+
+
+	def append_prices(self, prices, fix_history=False):
+		"""Not supported for fleets: pls. call set_prices() with the whole price vector."""
+		raise NotImplementedError("append_prices() is not supported by portfolio.")
+
+
+	def plot_24hOperation(self, date):
+		"""Not supported for fleets (the dispatch has a column per unit): pls. plot self.dv_soln."""
+		raise NotImplementedError("plot_24hOperation() is not supported by portfolio.")
+
+
+	def plot_EarningsOverTime(self):
+		"""Not supported for fleets: pls. plot self.earnings (a column per unit and 'Aggregate')."""
+		raise NotImplementedError("plot_EarningsOverTime() is not supported by portfolio.")
+
+
+	def plot_CashFlows(self, plot='RevAndCosts', Summary=False):
+		"""Not supported for fleets: pls. plot self.stats (rows per unit and 'Aggregate')."""
+		raise NotImplementedError("plot_CashFlows() is not supported by portfolio.")
+
+
+	def cube_profile(self, column='Price', by='hr', month=None, dow=None):
+		"""Returns the average price per time step, as in batopt.cube_profile(). The dispatch columns ('Charge',
+		'Discharge', 'Earnings') are not supported for fleets."""
+		if column != 'Price':
+			raise NotImplementedError("cube_profile() of portfolio only supports column='Price'.")
+		return bo.batopt.cube_profile(self, column, by, month, dow)
+
+
+	def __formulateprob(self):
+		"""Formulates the fleet optimization problem from the sparse blocks of fleet_matrices()."""
+		self.prob = Model(self.name, env=self.env)
+		if self.quiet:
+			self.prob.Params.OutputFlag = 0
+		n_units, n_steps = len(self.units), len(self.prices)
+
+		# Instrumented as an extra phase, 'matrices'
+		with self._phase('matrices'):
+			blocks = fleet_matrices(self.batspecs, n_steps, self.delta_t, grid_limit=self.grid_limit,
+			                        power_limit=self.power_limit)
+
+		# --------------------------------------------------------------------------- STEP 1: Build dvs
+		with self._phase('variables'):
+			x = self.prob.addMVar(len(blocks['lb']), lb=blocks['lb'], ub=blocks['ub'], vtype=blocks['vtype'])
+
+			# Views per dv type (rows = units); E includes the final charge (column n_steps)
+			self.dv_vecs = {dv_type: x[start:stop].reshape(n_units, -1)
+			                for dv_type, (start, stop) in blocks['slices'].items()}
+
+		# --------------------------------------------------------------------------- STEP 2: Build constraints
+		with self._phase('constraints'):
+			self.prob.addMConstr(blocks['A'], x, blocks['sense'], blocks['rhs'])
+
+		# --------------------------------------------------------------------------- STEP 3: Set objective
+		with self._phase('objective'):
+			price_coeffs = np.tile(np.asarray(self.prices, dtype='f8') * self.delta_t, n_units)
+			self.dv_vecs['Pdis'].reshape(-1).Obj = price_coeffs
+			self.dv_vecs['Pch'].reshape(-1).Obj = -price_coeffs
+			self.prob.ModelSense = GRB.MAXIMIZE
+			self.prob.update()
+
+		# --------------------------------------------------------------------------- STEP 4: Report
+		self._count_model()
+		self._report("\nProblem formulated")
+		self._report(str(self.prob))
+
+		return
+
+
+	def solve(self, calc_stats=True):
+		"""Solves the fleet problem. Upon success, extracts the solution and calculates the earnings."""
+		with self._phase('optimize'):
+			self.prob.optimize()
+
+		if self.prob.status == 2:
+			with self._phase('extraction'):
+				soln = {dv_type: np.asarray(dv.X) for dv_type, dv in self.dv_vecs.items()}
+				n_steps = len(self.prices)
+
+				# Assert Pch XOR Pdis, and charge neutrality
+				assert np.all(soln['Pch'] * soln['Pdis'] == 0)
+				assert np.all(soln['E'][:, 0] == soln['E'][:, -1])
+
+				dv_soln = {}
+				for idx, unit in enumerate(self.units):
+					dv_soln[unit, 'E'] = soln['E'][idx]
+					for dv_type in ('Pch', 'Pdis', 'b'):
+						# Padded with NaN at the end point, as in batopt
+						dv_soln[unit, dv_type] = np.append(soln[dv_type][idx], np.nan)
+
+				self.dv_soln = pd.DataFrame(dv_soln, index=range(n_steps+1))
+				self.dv_soln.columns.names = ['unit', 'dv']
+
+			self._report("\n\nGenerated revenue of {:0.2f} {} from {} to {}".format(
+				self.prob.objval, self.options['Currency'], self.Idx_toMarket(0), self.Idx_toMarket(n_steps-1)))
+
+			with self._phase('earnings'):
+				self.__calc_earnings()
+			if calc_stats: self.calc_stats()
+
+		return
+
+
+	def __calc_earnings(self):
+		"""Calculates self.earnings post-solution (per unit and aggregate)."""
+		prices = np.asarray(self.prices, dtype='f8')
+		Pch = self.dv_soln.xs('Pch', axis=1, level='dv').values[:-1]
+		Pdis = self.dv_soln.xs('Pdis', axis=1, level='dv').values[:-1]
+
+		flows = prices[:, None] * (Pdis - Pch) * self.delta_t
+		cumulative = np.vstack([np.zeros((1, len(self.units))), np.cumsum(flows, axis=0)])
+
+		self.earnings = pd.DataFrame(cumulative, index=range(len(self.prices)+1), columns=self.units)
+		self.earnings['Aggregate'] = self.earnings[self.units].sum(axis=1)
+
+		assert abs(self.earnings['Aggregate'].iat[-1] - self.prob.objval) < 10 ** -6 * max(1, abs(self.prob.objval))
+		return
+
+
+	def calc_stats(self):
+		"""Calculates the operation statistics (see batopt.calc_stats()) per unit and of the aggregate."""
+		with self._phase('stats'):
+			Pch = self.dv_soln.xs('Pch', axis=1, level='dv').iloc[:-1]
+			Pdis = self.dv_soln.xs('Pdis', axis=1, level='dv').iloc[:-1]
+
+			stats = {unit: bo.calc_opstats(self.prices, Pch[unit].values, Pdis[unit].values, self.fullmonths,
+			                               self.delta_t)
+			         for unit in self.units}
+			stats['Aggregate'] = bo.calc_opstats(self.prices, Pch.values.sum(axis=1), Pdis.values.sum(axis=1),
+			                                     self.fullmonths, self.delta_t)
+
+			self.stats = pd.concat(stats, names=['unit', 'period'])
+		return
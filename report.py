@@ -0,0 +1,298 @@
+"""Headless batch rendering of the batopt plots to image files.
+
+The plot_* methods of batopt draw interactive pyplot figures, one after another (plot_24hOperation() shows two
+figures per day). render_report() instead renders the daily operation, monthly price and cash flow plots of a solved
+batopt straight to files (PNG, SVG or any format supported by matplotlib):
+
+	- No pyplot: figures are matplotlib.figure.Figure objects, saved with the non-interactive Agg/SVG canvases.
+	- The daily figure is built once per worker process (for the longest, 25-hour market day, at the time step of the
+	  market time); every day then only updates the data of its artists (line data, bar heights, tick labels) before
+	  saving.
+	- The days, months and cash flow plots are rendered in parallel by a process pool. The workers receive plain
+	  NumPy arrays, not the batopt instance (which holds the Gurobi model).
+
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from matplotlib.figure import Figure
+
+import markettime as mt
+
+# Colors of batopt's plots
+colors = {
+	'Stored Energy': '#1F77B4',
+	'Charge': '#CB4335',
+	'Discharge': '#138D75',
+	'Price': '#616A6B',
+	'Energy Rev': '#CB4335',
+	'Energy Costs': '#F1C40F',
+	'Net': '#27AE60',
+}
+
+# Reused figures, per worker process
+_canvases = {}
+
+
+class _DayCanvas():
+	"""Figure of the daily operation (top) and prices (bottom). The artists are created once, for the time steps of the
+	longest (25-hour) market day, and updated per day in draw()."""
+	max_hours = 25
+
+	def __init__(self, Pr, Er, currency, steps_per_hour=1):
+		self.steps_per_hour = steps_per_hour
+		self.max_steps = self.max_hours * steps_per_hour
+		self.fig = Figure(figsize=(15, 8))
+		self.ax_op, self.ax_pr = self.fig.subplots(2, 1, gridspec_kw={'height_ratios': [5, 3]})
+		x = np.arange(self.max_steps)
+
+		# ------------------------------------------------------------ Operation
+		self.line_E, = self.ax_op.plot([], [], color=colors['Stored Energy'], label='Stored Energy')
+		self.bars_ch = self.ax_op.bar(x, np.zeros(self.max_steps), align='edge', width=1, color=colors['Charge'],
+		                              label='Charge')
+		self.bars_dis = self.ax_op.bar(x, np.zeros(self.max_steps), align='edge', width=1,
+		                               color=colors['Discharge'], label='Discharge')
+
+		self.ax_op.set_ylabel('Stored energy [kWh] / Output power [kW]', fontsize=13)
+		self.ax_op.axhline(color="#1B2631", linewidth=0.5)
+		self.ax_op.set_ylim(-Pr * 1.2, Er + Pr)
+		self.ax_op.legend(loc=1)
+		self.title_op = self.ax_op.set_title('Battery Operation', fontsize=14, fontweight='bold')
+
+		# ------------------------------------------------------------ Prices
+		self.line_pr, = self.ax_pr.plot([], [], color=colors['Price'])
+		self.ax_pr.set_xlabel('time', fontsize=13)
+		self.ax_pr.set_ylabel('Price [{}/MWh]'.format(currency), fontsize=13)
+		self.title_pr = self.ax_pr.set_title('Price Plot', fontsize=14, fontweight='bold')
+
+		for ax in (self.ax_op, self.ax_pr):
+			ax.tick_params(labelsize=12)
+			ax.grid(True, color='#EAECEE')
+			ax.set_axisbelow(True)
+
+		self.tick_labels = None
+		self.fig.tight_layout()
+		return
+
+
+	def draw(self, day, path, currency):
+		"""Updates the artists with the data of day (see _day_payloads()) and saves the figure to path."""
+		n_steps = len(day['Pch'])
+
+		self.line_E.set_data(np.arange(n_steps+1), day['E'])
+		for idx, (bar_ch, bar_dis) in enumerate(zip(self.bars_ch, self.bars_dis)):
+			visible = idx < n_steps
+			bar_ch.set_visible(visible)
+			bar_dis.set_visible(visible)
+			if visible:
+				bar_ch.set_height(-day['Pch'][idx])
+				bar_dis.set_height(day['Pdis'][idx])
+
+		self.line_pr.set_data(np.arange(n_steps), day['Price'] * 1000)
+		self.ax_pr.relim()
+		self.ax_pr.autoscale_view(scalex=False)
+
+		# Ticks every 2 market hours, labelled by market hour (only reset on the DST days)
+		tick_every = 2 * self.steps_per_hour
+		labels = ["H{}".format(str(hr).zfill(2)) for hr in day['hr'][::tick_every]]
+		if labels != self.tick_labels:
+			for ax in (self.ax_op, self.ax_pr):
+				ax.set_xticks(np.arange(0, n_steps, tick_every))
+				ax.set_xticklabels(labels)
+				ax.set_xlim(0, n_steps)
+			self.tick_labels = labels
+
+		self.title_op.set_text("Battery Operation, {}   (Revenue: {:0.2f} {})".format(day['label'], day['revenue'],
+		                                                                              currency))
+		self.fig.savefig(path, **_save_kwargs(path))
+		return
+
+
+def _save_kwargs(path):
+	"""savefig() options per format. PNG compression is kept low: encoding dominates the rendering time otherwise."""
+	if path.endswith('.png'):
+		return {'pil_kwargs': {'compress_level': 1}}
+	return {}
+
+
+def _day_canvas(Pr, Er, currency, steps_per_hour):
+	"""Returns the reused day canvas of this process."""
+	key = ('day', Pr, Er, currency, steps_per_hour)
+	if key not in _canvases:
+		_canvases[key] = _DayCanvas(Pr, Er, currency, steps_per_hour)
+	return _canvases[key]
+
+
+def _render_days(days, Pr, Er, currency, steps_per_hour, out_dir, fmt):
+	"""Worker. Renders a chunk of days on the reused canvas."""
+	canvas = _day_canvas(Pr, Er, currency, steps_per_hour)
+	paths = []
+
+	for day in days:
+		path = os.path.join(out_dir, "day_{}.{}".format(day['date'].strftime('%Y-%m-%d'), fmt))
+		canvas.draw(day, path, currency)
+		paths.append(path)
+
+	return paths
+
+
+def _render_months(months, currency, out_dir, fmt):
+	"""Worker. Renders the 24-hr aggregated price plots (see batopt.plot_monthprices()) of a chunk of months."""
+	fig = Figure(figsize=(12, 5))
+	ax = fig.subplots()
+	paths = []
+
+	for mmm, Prices_byhr in months:
+		# Box plots have no data setters; only the axes are cleared
+		ax.clear()
+		ax.boxplot(list(Prices_byhr.values()))
+		ax.set_xticklabels(["H{}".format(str(hr).zfill(2)) for hr in Prices_byhr])
+		ax.set_title("24-hr aggregated prices for {}".format(mmm), fontsize=13)
+		ax.set_ylabel("{}/MWh".format(currency), fontsize=12)
+		ax.tick_params(labelsize=12)
+
+		path = os.path.join(out_dir, "month_{}.{}".format(mmm, fmt))
+		fig.savefig(path, **_save_kwargs(path))
+		paths.append(path)
+
+	return paths
+
+
+def _render_cashflows(stats, year, currency, out_dir, fmt):
+	"""Worker. Renders the cash flow plots (see batopt.plot_CashFlows()) of the FULL months."""
+	fig = Figure(figsize=(12, 5))
+	ax = fig.subplots()
+	paths = []
+
+	Lf = stats.index != 'Overall'
+	months = list(stats.index[Lf])
+
+	for plot in ('RevAndCosts', 'Net'):
+		ax.clear()
+		if plot == 'RevAndCosts':
+			ax.bar(months, stats.loc[Lf, 'Energy Revenue'], color=colors['Energy Rev'], width=1,
+			       label='Energy Rev')
+			ax.bar(months, -1 * stats.loc[Lf, 'Energy Costs'], color=colors['Energy Costs'], width=1,
+			       label='Energy Costs')
+			ax.legend(loc=0, fontsize=11)
+			ax.set_title("Energy Revenues and Costs", fontsize=14, fontweight='bold')
+		else:
+			ax.bar(months, stats.loc[Lf, 'Net Earnings'], color=colors['Net'], width=1)
+			ax.set_title("Net Earnings", fontsize=14, fontweight='bold')
+
+		ax.set_xlabel(year, fontsize=13)
+		ax.set_ylabel(currency, fontsize=13)
+		ax.tick_params(labelsize=13)
+		ax.axhline(linewidth=1, color='k')
+
+		path = os.path.join(out_dir, "cashflow_{}.{}".format(plot, fmt))
+		fig.savefig(path, **_save_kwargs(path))
+		paths.append(path)
+
+	return paths
+
+
+def _day_payloads(battery, dates=None):
+	"""Returns the data of the daily plots of a solved batopt, as a list of dicts of arrays (one per market day).
+	Days are delimited by the market date labels of battery.timetable, so DST days have 23 or 25 steps."""
+	tbl = battery.timetable
+	E = battery.dv_soln['E'].values.astype('f8')
+	Pch = battery.dv_soln['Pch'].values.astype('f8')
+	Pdis = battery.dv_soln['Pdis'].values.astype('f8')
+	earnings = battery.earnings.values
+
+	# Boundaries of the runs of equal dates
+	dt_codes = tbl['date'].values
+	starts = np.flatnonzero(np.r_[True, dt_codes[1:] != dt_codes[:-1]])
+	stops = np.r_[starts[1:], len(tbl)]
+
+	payloads = []
+	for start, stop in zip(starts, stops):
+		date = dt_codes[start]
+		if dates is not None and date not in dates:
+			continue
+
+		payloads.append({
+			'date': date,
+			'label': date.strftime("%b %d"),
+			'hr': tbl['hr'].values[start:stop],
+			# E includes the end point
+			'E': E[start:stop+1],
+			'Pch': Pch[start:stop],
+			'Pdis': Pdis[start:stop],
+			'Price': tbl['Price'].values[start:stop],
+			'revenue': earnings[stop] - earnings[start],
+		})
+
+	return payloads
+
+
+def render_report(battery, out_dir, fmt='png', dates=None, months=True, cashflows=True, max_workers=None):
+	"""Renders the plots of a solved batopt to files in out_dir.
+
+	ARGUMENTS:
+		battery         Solved batopt instance
+
+		out_dir         Output directory (created if needed)
+
+		fmt             File format/extension (e.g. 'png', 'svg')
+
+		dates           Iterable of datetime.date to render (defaults to every market day in the period)
+
+		months          If True, renders the 24-hr aggregated prices of every FULL month
+
+		cashflows       If True, renders the cash flow plots
+
+		max_workers     Number of worker processes (defaults to os.cpu_count())
+
+	RETURNS:
+		List of the paths of the files written
+	"""
+	if battery.dv_soln is None:
+		raise RuntimeError("No solution. Cannot generate the report at this point.")
+	if battery.stats is None:
+		battery.calc_stats()
+
+	os.makedirs(out_dir, exist_ok=True)
+	if max_workers is None:
+		max_workers = os.cpu_count() or 1
+
+	currency = battery.options['Currency']
+	Pr = float(battery.batspecs['Power [kW]'])
+	Er = float(battery.batspecs['Capacity [kWh]'])
+
+	# Time steps per market hour (e.g. 4 for 15-min market times)
+	steps_per_hour = 1 / battery.delta_t
+	if not float(steps_per_hour).is_integer():
+		raise NotImplementedError("Only market times that divide the hour evenly are supported.")
+	steps_per_hour = int(steps_per_hour)
+
+	# ------------------------------------------------------------------- STEP 1: Payloads
+	days = _day_payloads(battery, None if dates is None else set(dates))
+
+	month_data = []
+	if months:
+		for mm in battery.fullmonths:
+			month_tbl = battery.timetable.loc[battery.timetable['month'] == mm]
+			month_data.append((mt.month_abrv[mm],
+			                   {hr: grp['Price'].values * 1000 for hr, grp in month_tbl.groupby('hr')}))
+
+	# ------------------------------------------------------------------- STEP 2: Render in parallel
+	# One chunk of days per worker, so that each worker builds its day canvas once
+	n_chunks = min(max_workers, len(days)) or 1
+	day_chunks = [days[idx::n_chunks] for idx in range(n_chunks)]
+
+	paths = []
+	with ProcessPoolExecutor(max_workers=max_workers) as pool:
+		futures = [pool.submit(_render_days, chunk, Pr, Er, currency, steps_per_hour, out_dir, fmt)
+		           for chunk in day_chunks if chunk]
+		if month_data:
+			futures.append(pool.submit(_render_months, month_data, currency, out_dir, fmt))
+		if cashflows:
+			futures.append(pool.submit(_render_cashflows, battery.stats, battery.year, currency, out_dir, fmt))
+
+		for future in futures:
+			paths.extend(future.result())
+
+	return paths
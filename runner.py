@@ -0,0 +1,281 @@
+"""Resumable batch valuation from the command line.
+
+A campaign is defined by a JSON manifest. Every combination of price file x battery model x start time is a job, run
+through batopt on the given market time:
+
+	{
+		"prices": ["Input/CAISO_prices_2018.pkl", {"path": "other.csv", "column": "USD/kWh"}],
+		"models": ["Tesla Powerpack"],
+		"start_times": [["01/01/2018", 1]],
+		"market_time": "CA_time"
+	}
+
+	prices          Price files, as paths or {"path": ..., "column": ...}. Pickled Series/DataFrames (.pkl),
+					.csv and .npy files are read. The column defaults to 'USD/kWh' for DataFrames. Relative paths
+					are relative to the manifest.
+
+	models          Battery models (columns of batopt.BatteryDefns)
+
+	start_times     Market times of the first price, as ["MM/DD/YYYY", hour] (see batopt.set_prices())
+
+	market_time     Name of a market time instance in markettime (e.g. 'CA_time')
+
+The jobs run in a process pool. Each finished job writes its own part file to <out>/parts/<job id>.pkl (written to
+a temporary file, then renamed), holding batopt's stats and the objective value as a long table (one row per month
+and 'Overall'). A job is complete once its part exists; on restart, these jobs are skipped. Jobs that raise or are
+not solved to optimality are reported as failed and not written, so they are retried on the next run. load_results()
+reads the store back as one DataFrame.
+
+Job ids are hashed from the job definition, with the price file as given in the manifest (relative to it), so that a
+campaign directory can be moved or copied and resumed.
+
+Usage (from the project directory):
+
+	python runner.py campaign.json --out results --max-workers 4
+
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+import batopt as bo
+import markettime as mt
+
+# Columns identifying a job in the results (price_file is relative to the manifest)
+job_columns = ['job', 'price_file', 'column', 'model', 'start_date', 'start_hr', 'market_time']
+
+# Prices already read by this (worker) process, by (path, column)
+_price_cache = {}
+
+
+def read_manifest(path):
+	"""Reads a manifest and returns the list of its jobs, as dicts (with the keys of job_columns, and 'price_path', the
+	absolute path of the price file)."""
+	with open(path) as f:
+		manifest = json.load(f)
+
+	for key in ('prices', 'models', 'start_times', 'market_time'):
+		if key not in manifest:
+			raise ValueError("The manifest is missing '{}'.".format(key))
+
+	base_dir = os.path.dirname(os.path.abspath(path))
+	price_files = []
+	for entry in manifest['prices']:
+		if isinstance(entry, str):
+			entry = {'path': entry}
+		price_files.append((os.path.normpath(entry['path']).replace(os.sep, '/'), entry.get('column')))
+
+	jobs = []
+	for (price_file, column), model, (start_date, start_hr) in itertools.product(price_files, manifest['models'],
+	                                                                              manifest['start_times']):
+		job = {
+			'price_file': price_file,
+			'price_path': os.path.normpath(os.path.join(base_dir, price_file)),
+			'column': column,
+			'model': model,
+			'start_date': start_date,
+			'start_hr': int(start_hr),
+			'market_time': manifest['market_time'],
+		}
+		job['job'] = job_id(job)
+		jobs.append(job)
+
+	return jobs
+
+
+def job_id(job):
+	"""Returns a stable id of the job, from its definition (the same job gets the same id across runs, and wherever the
+	campaign directory is)."""
+	key = json.dumps([job['price_file'], job['column'], job['model'], job['start_date'], job['start_hr'],
+	                  job['market_time']])
+	return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+
+def read_prices(path, column=None):
+	"""Reads a price vector from a .pkl (Series or DataFrame), .csv or .npy file, as a float array."""
+	key = (path, column)
+	if key not in _price_cache:
+		if path.endswith('.npy'):
+			prices = np.load(path)
+		else:
+			data = pd.read_csv(path) if path.endswith('.csv') else pd.read_pickle(path)
+			if isinstance(data, pd.DataFrame):
+				data = data[column or 'USD/kWh']
+			prices = data.values
+
+		_price_cache[key] = np.asarray(prices, dtype='f8')
+
+	return _price_cache[key]
+
+
+def get_market_time(name):
+	"""Returns the market time instance named name in markettime."""
+	market_time = getattr(mt, name, None)
+	if not isinstance(market_time, mt.CAISO):
+		raise ValueError("Unknown market time '{}'.".format(name))
+	return market_time
+
+
+def _run_job(job):
+	"""Worker. Runs batopt on one job, and returns its results as a long DataFrame (one row per stats row). Raises
+	RuntimeError if the job is not solved to optimality."""
+	start = time.perf_counter()
+
+	battery = bo.batopt(job['model'], name=job['job'], quiet=True)
+	battery.set_prices(read_prices(job['price_path'], job['column']), start_time=(job['start_date'], job['start_hr']),
+	                   market_time=get_market_time(job['market_time']))
+	battery.solve()
+
+	status = battery.prob.status
+	if battery.stats is None:
+		battery.prob.dispose()
+		# Not written, so that the job is retried
+		raise RuntimeError("Not solved to optimality (Gurobi status {}).".format(status))
+
+	part = battery.stats.astype('f8')
+	objective = battery.prob.objVal
+	battery.prob.dispose()
+
+	part.index.name = 'month'
+	part = part.reset_index()
+	part['objective'] = objective
+	part['status'] = status
+	part['seconds'] = time.perf_counter() - start
+
+	for col in reversed(job_columns):
+		part.insert(0, col, job[col])
+
+	return part
+
+
+def _part_path(out_dir, job):
+	return os.path.join(out_dir, 'parts', "{}.pkl".format(job['job']))
+
+
+def _write_part(out_dir, job, part):
+	"""Writes the part of a finished job (atomically, so that an interrupted write leaves no part)."""
+	path = _part_path(out_dir, job)
+	tmp_path = path + '.tmp'
+	part.to_pickle(tmp_path)
+	os.replace(tmp_path, path)
+	return path
+
+
+def pending_jobs(jobs, out_dir):
+	"""Returns the jobs that have no part in out_dir yet."""
+	return [job for job in jobs if not os.path.exists(_part_path(out_dir, job))]
+
+
+def load_results(out_dir):
+	"""Reads the results store in out_dir, as one DataFrame (columns: job_columns, 'month', the stats columns,
+	'objective', 'status' and 'seconds')."""
+	parts_dir = os.path.join(out_dir, 'parts')
+	paths = sorted(fn for fn in os.listdir(parts_dir) if fn.endswith('.pkl')) if os.path.isdir(parts_dir) else []
+	if not paths:
+		return pd.DataFrame(columns=job_columns + ['month'])
+
+	return pd.concat([pd.read_pickle(os.path.join(parts_dir, fn)) for fn in paths], ignore_index=True, sort=False)
+
+
+def _format_seconds(seconds):
+	seconds = int(round(seconds))
+	return "{}:{:02d}:{:02d}".format(seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+def run_jobs(jobs, out_dir, max_workers=None, report=print):
+	"""Runs the jobs that are not complete in out_dir yet, in a process pool of max_workers (defaults to
+	os.cpu_count()), and writes their parts. Progress and ETA are passed to report (one line per finished job).
+
+	On KeyboardInterrupt, the queued jobs are cancelled (the parts of the finished jobs are already written) and the
+	KeyboardInterrupt is re-raised, so that the next run continues with the jobs not written.
+
+	RETURNS:
+		(n_done, failed)
+
+		n_done          Number of jobs finished (and written) in this run
+
+		failed          {job id: error message} of the jobs that raised or were not solved to optimality
+	"""
+	os.makedirs(os.path.join(out_dir, 'parts'), exist_ok=True)
+	if max_workers is None:
+		max_workers = os.cpu_count() or 1
+
+	pending = pending_jobs(jobs, out_dir)
+	n_skipped = len(jobs) - len(pending)
+	report("{} jobs, {} already complete, {} to run".format(len(jobs), n_skipped, len(pending)))
+
+	n_done = 0
+	failed = {}
+	start = time.perf_counter()
+
+	pool = ProcessPoolExecutor(max_workers=max_workers)
+	futures = {pool.submit(_run_job, job): job for job in pending}
+	try:
+		for count, future in enumerate(as_completed(futures), 1):
+			job = futures[future]
+			try:
+				part = future.result()
+			except Exception:
+				failed[job['job']] = traceback.format_exc(limit=1).strip().splitlines()[-1]
+				outcome = "FAILED ({})".format(failed[job['job']])
+			else:
+				_write_part(out_dir, job, part)
+				n_done += 1
+				outcome = "objective {:0.2f}".format(part['objective'].iat[0])
+
+			# ETA from the average throughput so far
+			elapsed = time.perf_counter() - start
+			eta = elapsed / count * (len(pending) - count)
+			report("[{:>{w}}/{}] {} | {} | {} {} | {}   elapsed {}  ETA {}".format(
+				n_skipped + count, len(jobs), job['model'], os.path.basename(job['price_file']), job['start_date'],
+				job['start_hr'], outcome, _format_seconds(elapsed), _format_seconds(eta), w=len(str(len(jobs)))))
+	except KeyboardInterrupt:
+		# Without waiting for the queued jobs (a with block would run them all before exiting)
+		for future in futures:
+			future.cancel()
+		pool.shutdown(wait=False)
+		report("Interrupted: {} jobs finished in this run. Run again to continue.".format(n_done))
+		raise
+	else:
+		pool.shutdown()
+
+	return n_done, failed
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Resumable batch valuation with batopt")
+	parser.add_argument('manifest', help="Job manifest (JSON)")
+	parser.add_argument('--out', default='results', help="Results directory")
+	parser.add_argument('--max-workers', type=int, default=None, help="Number of worker processes")
+	parser.add_argument('--list', action='store_true', help="Only list the jobs and whether they are complete")
+	args = parser.parse_args(argv)
+
+	jobs = read_manifest(args.manifest)
+
+	if args.list:
+		pending = {job['job'] for job in pending_jobs(jobs, args.out)}
+		for job in jobs:
+			print("{} {:>8} | {} | {} | {} {}".format(job['job'], 'pending' if job['job'] in pending else 'done',
+			                                          job['model'], job['price_file'], job['start_date'],
+			                                          job['start_hr']))
+		return 0
+
+	try:
+		n_done, failed = run_jobs(jobs, args.out, max_workers=args.max_workers)
+	except KeyboardInterrupt:
+		return 130
+	print("{} jobs finished, {} failed. Results in {}".format(n_done, len(failed), args.out))
+	return 1 if failed else 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
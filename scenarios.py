@@ -0,0 +1,255 @@
+"""Monte Carlo valuation of a battery over many price scenarios.
+
+A single batopt run values the battery under perfect foresight of ONE price path. This module runs batopt over a
+matrix of price paths (rows = scenarios, columns = time steps on the same time vector as batopt.prices) and reports
+the distribution of the monthly net earnings.
+
+The scenario matrix is either generated (bootstrap_prices(), which resamples whole market days of a price vector)
+or loaded from disk (load_scenarios()). valuate_scenarios() places the matrix in a multiprocessing.shared_memory
+block, so that the worker processes read their price paths directly from it, without copies or pickling.
+
+	bootstrap_prices()      Generates scenarios by resampling market days within each month
+	load_scenarios()        Loads a scenario matrix saved with numpy.save (.npy)
+	valuate_scenarios()     Runs batopt on every scenario in parallel, and returns the percentile bands of the
+							monthly 'Net Earnings'
+
+"""
+import os
+import datetime
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+import batopt as bo
+
+
+class SharedPrices():
+	"""Scenario matrix held in a multiprocessing.shared_memory block. Use as a context manager; the block is
+	unlinked on exit."""
+
+	def __init__(self, scenarios):
+		scenarios = np.asarray(scenarios, dtype='f8')
+		if scenarios.ndim != 2:
+			raise ValueError("The scenario matrix must be 2D (scenarios x time steps).")
+
+		self.shape = scenarios.shape
+		self.dtype = scenarios.dtype.str
+		self.shm = shared_memory.SharedMemory(create=True, size=max(scenarios.nbytes, 1))
+
+		# Single copy, into the shared block
+		self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=self.shm.buf)
+		self.array[:] = scenarios
+		return
+
+
+	@property
+	def name(self):
+		return self.shm.name
+
+
+	def close(self):
+		"""Releases and unlinks the shared block."""
+		self.array = None
+		self.shm.close()
+		self.shm.unlink()
+		return
+
+
+	def __enter__(self):
+		return self
+
+
+	def __exit__(self, exc_type, exc_val, exc_tb):
+		self.close()
+		return False
+
+
+
+def load_scenarios(path, mmap=True):
+	"""Loads a scenario matrix (scenarios x time steps) saved with numpy.save(). If mmap, the file is memory-mapped
+	instead of read whole (it is then read once, when copied into shared memory by valuate_scenarios())."""
+	scenarios = np.load(path, mmap_mode='r' if mmap else None)
+
+	if scenarios.ndim != 2:
+		raise ValueError("{} does not hold a 2D scenario matrix.".format(path))
+	return scenarios
+
+
+def market_labels(n, start_time, market_time):
+	"""Returns the market date and hour of the n time steps starting at start_time, as a DataFrame with columns
+	['date', 'month', 'hr'] on the range index (same as batopt's).
+
+	ARGUMENTS:
+		n               Number of time steps
+
+		start_time      Market time as ("MM/DD/YYYY", hour), as in batopt.set_prices()
+
+		market_time     Market time implementation (hourly, e.g. markettime.CA_time)
+	"""
+	start_dt = datetime.datetime.strptime(start_time[0], '%m/%d/%Y')
+	stamps = market_time.market_range(market_time.TimeStamp(start_dt, start_time[1]), n)
+
+	return pd.DataFrame({'date': [ts.dt for ts in stamps],
+	                     'month': np.array([ts.month for ts in stamps], dtype='i4'),
+	                     'hr': np.array([ts.hr for ts in stamps], dtype='i4')})
+
+
+def bootstrap_prices(prices, start_time, market_time, n_scenarios, seed=None):
+	"""Generates price scenarios by resampling whole market days of the price vector. Each day of the period is
+	replaced by a randomly drawn day of the same month, to preserve the seasonal profile.
+
+	Days are matched by market hour label (not position), so that the 23- and 25-hour DST days are filled
+	correctly: a missing H25 in the drawn day is taken from its H02 (the hour it repeats), and a missing H03 is
+	interpolated from H02 and H04.
+
+	ARGUMENTS:
+		prices          Iterable of prices (as passed to batopt.set_prices())
+
+		start_time      Market time as ("MM/DD/YYYY", hour)
+
+		market_time     Market time implementation (hourly)
+
+		n_scenarios     Number of scenarios to generate
+
+		seed            Seed of the random generator
+
+	RETURNS:
+		Array of shape (n_scenarios, len(prices))
+	"""
+	if market_time.delta_t != datetime.timedelta(hours=1):
+		raise NotImplementedError("Day resampling is only implemented for hourly market times.")
+
+	prices = np.asarray(prices, dtype='f8')
+	labels = market_labels(len(prices), start_time, market_time)
+
+	# ------------------------------------------------------------------- STEP 1: Price table (days x H01-H25)
+	day_codes, days = pd.factorize(labels['date'])
+	day_table = np.full((len(days), 25), np.nan)
+	day_table[day_codes, labels['hr'].values-1] = prices
+
+	# Fill the DST hours, so that any day can stand in for any other
+	h25 = np.isnan(day_table[:, 24])
+	day_table[h25, 24] = day_table[h25, 1]
+	h03 = np.isnan(day_table[:, 2])
+	day_table[h03, 2] = (day_table[h03, 1] + day_table[h03, 3]) / 2
+
+	# Partial days at the ends may still have gaps; they are only drawn within their own (partial) month.
+	# ------------------------------------------------------------------- STEP 2: Draw days within each month
+	rng = np.random.default_rng(seed)
+	day_month = np.array([dt.month for dt in days])
+	complete = ~np.isnan(day_table[:, :24]).any(axis=1)
+
+	drawn = np.empty((n_scenarios, len(days)), dtype='i8')
+	for mm in np.unique(day_month):
+		in_month = np.flatnonzero(day_month == mm)
+		pool = in_month[complete[in_month]]
+		if len(pool) == 0:
+			# Month only has a partial day -- keep it as is
+			drawn[:, in_month] = in_month
+			continue
+		drawn[:, in_month] = rng.choice(pool, size=(n_scenarios, len(in_month)))
+
+	# ------------------------------------------------------------------- STEP 3: Assemble the paths
+	scenarios = day_table[drawn[:, day_codes], labels['hr'].values-1]
+
+	# Gaps can only come from the partial days kept as is; these are the original prices.
+	gaps = np.isnan(scenarios)
+	if gaps.any():
+		scenarios[gaps] = np.broadcast_to(prices, scenarios.shape)[gaps]
+
+	return scenarios
+
+
+def _value_rows(shm_name, shape, dtype, rows, model, start_time, market_time):
+	"""Worker. Attaches to the shared scenario matrix and values the given rows. Returns {row: Net Earnings}."""
+	shm = shared_memory.SharedMemory(name=shm_name)
+	try:
+		scenarios = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+		results = {}
+
+		for row in rows:
+			battery = bo.batopt(model, name='Scenario {}'.format(row), quiet=True)
+			# Bound as a view of the shared block
+			battery.set_prices(scenarios[row], start_time=start_time, market_time=market_time)
+			battery.solve()
+
+			if battery.stats is not None:
+				results[row] = battery.stats['Net Earnings'].astype('f8')
+			else:
+				results[row] = None
+
+			del battery
+		del scenarios
+	finally:
+		shm.close()
+
+	return results
+
+
+def valuate_scenarios(scenarios, model, start_time, market_time, percentiles=(5, 25, 50, 75, 95),
+                      max_workers=None, chunksize=None):
+	"""Values the battery over every price scenario, in parallel.
+
+	ARGUMENTS:
+		scenarios       Array of shape (n_scenarios, n_steps). Every row is a price path starting at start_time.
+
+		model           Battery model (column of batopt.BatteryDefns)
+
+		start_time      Market time as ("MM/DD/YYYY", hour), as in batopt.set_prices()
+
+		market_time     Market time implementation
+
+		percentiles     Percentiles of the bands
+
+		max_workers     Number of worker processes (defaults to os.cpu_count())
+
+		chunksize       Number of scenarios valued per task. Defaults to splitting the scenarios in ~4 tasks per
+						worker.
+
+	RETURNS:
+		(bands, earnings)
+
+		bands           DataFrame of the percentiles of 'Net Earnings' (index = FULL months and 'Overall', as in
+						batopt.stats; columns = percentiles)
+
+		earnings        DataFrame of 'Net Earnings' per scenario (index = scenario; columns = months and
+						'Overall'). Scenarios that did not solve to optimality are NaN.
+	"""
+	scenarios = np.asarray(scenarios)
+	if scenarios.ndim != 2:
+		raise ValueError("The scenario matrix must be 2D (scenarios x time steps).")
+
+	n_scenarios = scenarios.shape[0]
+	if max_workers is None:
+		max_workers = os.cpu_count() or 1
+	if chunksize is None:
+		chunksize = max(1, -(-n_scenarios // (4*max_workers)))
+
+	chunks = [range(start, min(start+chunksize, n_scenarios)) for start in range(0, n_scenarios, chunksize)]
+	results = {}
+
+	with SharedPrices(scenarios) as shared:
+		with ProcessPoolExecutor(max_workers=max_workers) as pool:
+			futures = [pool.submit(_value_rows, shared.name, shared.shape, shared.dtype, rows, model, start_time,
+			                       market_time)
+			           for rows in chunks]
+
+			for future in futures:
+				results.update(future.result())
+
+	# ------------------------------------------------------------------- Collect
+	columns = next((ser.index for ser in results.values() if ser is not None), None)
+	if columns is None:
+		raise RuntimeError("None of the scenarios were solved to optimality.")
+
+	earnings = pd.DataFrame(index=range(n_scenarios), columns=columns, dtype='f8')
+	for row, ser in results.items():
+		if ser is not None:
+			earnings.loc[row] = ser.values
+
+	bands = pd.DataFrame({pct: earnings.quantile(pct/100) for pct in percentiles})
+	bands.columns.name = 'Percentile'
+
+	return bands, earnings
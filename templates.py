@@ -0,0 +1,304 @@
+"""Compiled model templates of batopt, cached in memory and on disk.
+
+The constraints of batopt (charge balance, Pch XOR Pdis, charge neutrality) and the bounds and types of its variables
+depend only on the number of time steps, delta_t and the battery specs, never on the prices. A template is this
+structure compiled once in matrix form (see fleet_matrices(), for one unit):
+
+	A x (sense) rhs,    lb <= x <= ub,    x of types vtype
+
+with x stacked as E (n_steps+1), Pch, Pdis, b (n_steps each). batopt builds its model from a template with
+addMVar()/addMConstr(), and only sets the objective from the prices.
+
+Templates are looked up in a TemplateCache: an in-memory LRU, backed by an optional cache directory of .npz files
+(so that other processes, e.g. the workers of scenarios.py or runner.py, load the template instead of building it).
+The module cache is used by batopt; its directory is set with set_cache_dir() or the BATOPT_TEMPLATE_DIR environment
+variable. The hits and the build time saved are kept in cache.counters (see TemplateCache.report()).
+
+"""
+import collections
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from gurobipy import GRB
+
+
+def template_key(n_steps, delta_t, batspecs):
+	"""Returns the key of the template: (n_steps, delta_t, capacity, power, DoD, cycle efficiency)."""
+	return (int(n_steps), float(delta_t), float(batspecs['Capacity [kWh]']), float(batspecs['Power [kW]']),
+	        float(batspecs['DoD [%]']), float(batspecs['Cycle Efficiency [%]']))
+
+
+def build_template(key):
+	"""Builds the template of key (see template_key()), as a dict with keys 'A' (scipy.sparse.csr_matrix), 'sense',
+	'rhs', 'lb', 'ub', 'vtype', 'slices' ({dv type: (start, stop)} in x), 'key' and 'build_seconds'."""
+	start = time.perf_counter()
+	n_steps, delta_t = key[:2]
+	batspecs = _specs_frame(key)
+
+	template = fleet_matrices(batspecs, n_steps, delta_t)
+	template['key'] = key
+	template['build_seconds'] = time.perf_counter() - start
+	return template
+
+
+def fleet_matrices(batspecs, n_steps, delta_t, grid_limit=None, power_limit=None):
+	"""Builds the fleet problem in matrix form, A x (sense) rhs with lb <= x <= ub.
+
+	The variables x are stacked by type, each type row-major by unit:
+		E (n_units x n_steps+1), Pch (n_units x n_steps), Pdis (n_units x n_steps), b (n_units x n_steps)
+
+	The constraints are those of batopt (charge balance, Pch XOR Pdis, charge neutrality) per unit, plus the optional
+	shared limits.
+
+	ARGUMENTS:
+		batspecs        DataFrame of the unit specs (columns of batopt.BatteryDefns)
+
+		n_steps         Number of time steps
+
+		delta_t         Time step in numeric hours
+
+		grid_limit,
+		power_limit     Shared limits of a fleet [kW] (see portfolio.py), or None
+
+	RETURNS:
+		Dict with keys 'A' (scipy.sparse.csr_matrix), 'sense', 'rhs', 'lb', 'ub', 'vtype' (arrays) and 'slices'
+		({dv type: (start, stop)} positions of each type in x).
+	"""
+	n_units = batspecs.shape[1]
+	Er = batspecs.loc['Capacity [kWh]'].values.astype('f8')
+	Pr = batspecs.loc['Power [kW]'].values.astype('f8')
+	Emin = Er * (1 - batspecs.loc['DoD [%]'].values.astype('f8') / 100)
+	eff_ch = (batspecs.loc['Cycle Efficiency [%]'].values.astype('f8') / 100)**0.5
+	eff_dis = eff_ch
+
+	# ------------------------------------------------------------------- STEP 1: Variables
+	nE, nP = n_units*(n_steps+1), n_units*n_steps
+	slices = {'E': (0, nE), 'Pch': (nE, nE+nP), 'Pdis': (nE+nP, nE+2*nP), 'b': (nE+2*nP, nE+3*nP)}
+
+	lb = np.concatenate([np.repeat(Emin, n_steps+1), np.zeros(3*nP)])
+	ub = np.concatenate([np.repeat(Er, n_steps+1), np.repeat(Pr, n_steps), np.repeat(Pr, n_steps),
+	                     np.ones(nP)])
+	# The final charge may go down to 0 (as in batopt)
+	lb[n_steps:nE:n_steps+1] = 0
+	vtype = np.array([GRB.CONTINUOUS]*(nE+2*nP) + [GRB.BINARY]*nP)
+
+	# ------------------------------------------------------------------- STEP 2: Constraints (COO triplets)
+	# Position (unit, t) of each time step, and the matching columns
+	unit = np.repeat(np.arange(n_units), n_steps)
+	cE = unit*(n_steps+1) + np.tile(np.arange(n_steps), n_units)
+	cPch = slices['Pch'][0] + np.arange(nP)
+	cPdis = slices['Pdis'][0] + np.arange(nP)
+	cb = slices['b'][0] + np.arange(nP)
+	ones = np.ones(nP)
+
+	rows, cols, vals, sense, rhs = [], [], [], [], []
+
+	def add_block(block_rows, block_cols, block_vals, block_sense, block_rhs):
+		offset = sum(len(r) for r in rhs)
+		rows.append(np.concatenate(block_rows) + offset)
+		cols.append(np.concatenate(block_cols))
+		vals.append(np.concatenate(block_vals))
+		sense.append(np.full(len(block_rhs), block_sense))
+		rhs.append(np.asarray(block_rhs, dtype='f8'))
+
+	r = np.arange(nP)
+	# a) Charge balance: E(t+1) - E(t) - eff_ch*Pch*dt + Pdis/eff_dis*dt = 0
+	add_block([r, r, r, r], [cE+1, cE, cPch, cPdis],
+	          [ones, -ones, -np.repeat(eff_ch, n_steps)*delta_t, np.repeat(1/eff_dis, n_steps)*delta_t],
+	          GRB.EQUAL, np.zeros(nP))
+	# b) Pch/Pr - b <= 0
+	add_block([r, r], [cPch, cb], [1/np.repeat(Pr, n_steps), -ones], GRB.LESS_EQUAL, np.zeros(nP))
+	# c) Pdis/Pr + b <= 1
+	add_block([r, r], [cPdis, cb], [1/np.repeat(Pr, n_steps), ones], GRB.LESS_EQUAL, np.ones(nP))
+	# d) Final charge = starting charge
+	u = np.arange(n_units)
+	add_block([u, u], [u*(n_steps+1)+n_steps, u*(n_steps+1)], [np.ones(n_units), -np.ones(n_units)], GRB.EQUAL,
+	          np.zeros(n_units))
+
+	# e) Shared limits (one row per time step, summing over the units)
+	t = np.tile(np.arange(n_steps), n_units)
+	if grid_limit is not None:
+		add_block([t, t], [cPdis, cPch], [ones, -ones], GRB.LESS_EQUAL, np.full(n_steps, grid_limit))
+		add_block([t, t], [cPch, cPdis], [ones, -ones], GRB.LESS_EQUAL, np.full(n_steps, grid_limit))
+
+	if power_limit is not None:
+		add_block([t], [cPch], [ones], GRB.LESS_EQUAL, np.full(n_steps, power_limit))
+		add_block([t], [cPdis], [ones], GRB.LESS_EQUAL, np.full(n_steps, power_limit))
+
+	rhs = np.concatenate(rhs)
+	A = sp.csr_matrix((np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))),
+	                  shape=(len(rhs), len(lb)))
+
+	return {'A': A, 'sense': np.concatenate(sense), 'rhs': rhs, 'lb': lb, 'ub': ub, 'vtype': vtype,
+	        'slices': slices}
+
+
+def _specs_frame(key):
+	"""Returns the specs of key as a one-column DataFrame (the batspecs of fleet_matrices())."""
+	return pd.DataFrame({'unit': key[2:]}, index=['Capacity [kWh]', 'Power [kW]', 'DoD [%]', 'Cycle Efficiency [%]'])
+
+
+def save_template(template, path):
+	"""Saves the template to path (.npz). Written to a unique temporary file first, then renamed, so that concurrent
+	writers never collide and readers never see a partial file."""
+	A = template['A']
+	slices = template['slices']
+	fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix='.tmp_', suffix='.npz')
+	try:
+		with os.fdopen(fd, 'wb') as f:
+			np.savez(f, A_data=A.data, A_indices=A.indices, A_indptr=A.indptr, A_shape=np.array(A.shape),
+			         sense=template['sense'], rhs=template['rhs'], lb=template['lb'], ub=template['ub'],
+			         vtype=template['vtype'], slice_names=np.array(list(slices)),
+			         slice_bounds=np.array(list(slices.values())), key=np.array(template['key'], dtype='f8'),
+			         build_seconds=template['build_seconds'])
+		# Another process may have written the same template meanwhile; the files are equal
+		os.replace(tmp_path, path)
+	except BaseException:
+		if os.path.exists(tmp_path):
+			os.remove(tmp_path)
+		raise
+	return
+
+
+def load_template(path):
+	"""Loads a template saved with save_template()."""
+	with np.load(path) as data:
+		key = tuple(data['key'])
+		return {
+			'A': sp.csr_matrix((data['A_data'], data['A_indices'], data['A_indptr']), shape=tuple(data['A_shape'])),
+			'sense': data['sense'],
+			'rhs': data['rhs'],
+			'lb': data['lb'],
+			'ub': data['ub'],
+			'vtype': data['vtype'],
+			'slices': {name: tuple(int(pos) for pos in bounds)
+			           for name, bounds in zip(data['slice_names'], data['slice_bounds'])},
+			'key': (int(key[0]),) + key[1:],
+			'build_seconds': float(data['build_seconds']),
+		}
+
+
+class TemplateCache():
+	"""LRU cache of templates, in memory (up to maxsize templates) and, if cache_dir is set, on disk.
+
+	counters:
+		memory_hits     Templates found in memory
+		disk_hits       Templates loaded from cache_dir
+		misses          Templates built
+		build_seconds   Time spent building templates
+		saved_seconds   Build time saved by the hits (the template's build time, less the load time for disk hits)
+	"""
+
+	def __init__(self, maxsize=16, cache_dir=None):
+		self.maxsize = maxsize
+		self.cache_dir = cache_dir
+		self.templates = collections.OrderedDict()
+		self.counters = dict.fromkeys(('memory_hits', 'disk_hits', 'misses'), 0)
+		self.counters.update(dict.fromkeys(('build_seconds', 'saved_seconds'), 0.0))
+		self._lock = threading.Lock()
+		self._key_locks = {}                        # {key: lock}, so that only one thread builds/loads a template
+		return
+
+
+	def get(self, n_steps, delta_t, batspecs):
+		"""Returns the template of (n_steps, delta_t, batspecs), and where it came from ('memory', 'disk' or
+		'built')."""
+		key = template_key(n_steps, delta_t, batspecs)
+
+		hit = self._memory_hit(key)
+		if hit is not None:
+			return hit, 'memory'
+
+		# One thread builds (or loads) the template; the others wait for it, then find it in memory
+		with self._lock:
+			key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+		with key_lock:
+			hit = self._memory_hit(key)
+			if hit is not None:
+				return hit, 'memory'
+
+			path = self._path(key)
+			if path is not None and os.path.exists(path):
+				start = time.perf_counter()
+				template = load_template(path)
+				load_seconds = time.perf_counter() - start
+				source = 'disk'
+			else:
+				template = build_template(key)
+				source = 'built'
+				if path is not None:
+					os.makedirs(self.cache_dir, exist_ok=True)
+					save_template(template, path)
+
+			with self._lock:
+				if source == 'disk':
+					self.counters['disk_hits'] += 1
+					self.counters['saved_seconds'] += max(template['build_seconds'] - load_seconds, 0)
+				else:
+					self.counters['misses'] += 1
+					self.counters['build_seconds'] += template['build_seconds']
+
+				self.templates[key] = template
+				while len(self.templates) > self.maxsize:
+					self.templates.popitem(last=False)
+				self._key_locks.pop(key, None)
+
+		return template, source
+
+
+	def _memory_hit(self, key):
+		"""Returns the template of key if in memory (counting the hit), else None."""
+		with self._lock:
+			if key not in self.templates:
+				return None
+
+			self.templates.move_to_end(key)
+			self.counters['memory_hits'] += 1
+			self.counters['saved_seconds'] += self.templates[key]['build_seconds']
+			return self.templates[key]
+
+
+	def _path(self, key):
+		if self.cache_dir is None:
+			return None
+		name = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()[:16]
+		return os.path.join(self.cache_dir, "template_{}.npz".format(name))
+
+
+	@property
+	def hit_rate(self):
+		"""Share of the lookups served from memory or disk."""
+		hits = self.counters['memory_hits'] + self.counters['disk_hits']
+		lookups = hits + self.counters['misses']
+		return hits / lookups if lookups else 0.0
+
+
+	def report(self):
+		"""Returns a one-line summary of the counters."""
+		return ("Model templates: {memory_hits} memory hits, {disk_hits} disk hits, {misses} built "
+		        "(hit rate {rate:0.0%}); {build_seconds:0.3f} s building, {saved_seconds:0.3f} s saved"
+		        .format(rate=self.hit_rate, **self.counters))
+
+
+	def clear(self):
+		"""Empties the in-memory cache (the cache directory is kept)."""
+		with self._lock:
+			self.templates.clear()
+		return
+
+
+# Cache used by batopt
+cache = TemplateCache(cache_dir=os.environ.get('BATOPT_TEMPLATE_DIR'))
+
+
+def set_cache_dir(cache_dir):
+	"""Sets the cache directory of the module cache (None for memory only)."""
+	cache.cache_dir = cache_dir
+	return
@@ -0,0 +1,92 @@
+"""batopt.append_prices(): set_prices(N) then append_prices(M) must solve as a fresh model of the N+M steps (with the
+same dispatch fixed over the first N steps, for fix_history=True)."""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('gurobipy')
+
+import batopt as bo
+
+MODEL = 'Tesla Powerpack'
+
+# (start time, offset of the first price in the 2018 prices, N, M). N ends mid-day, so that a fixed history is
+# suboptimal for the N+M steps; the second period is split within the 23-hour DST day (03/11/2018).
+PERIODS = [
+	(('01/01/2018', 1), 0, 12, 60),
+	(('03/10/2018', 1), 68*24, 30, 65),
+]
+
+
+@pytest.fixture(scope='module')
+def prices():
+	path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Input', 'CAISO_prices_2018.pkl')
+	return pd.read_pickle(path)['USD/kWh'].values
+
+
+def _battery(prices, start_time, templates):
+	battery = bo.batopt(MODEL, quiet=True)
+	battery.options['Model templates'] = templates
+	battery.set_prices(prices, start_time=start_time, market_time=bo.CA_time)
+	return battery
+
+
+def _fresh(prices, start_time, templates, fixed_soln=None):
+	"""Solves the N+M steps from scratch, optionally with the dispatch of fixed_soln (N steps) fixed."""
+	battery = _battery(prices, start_time, templates)
+	if fixed_soln is not None:
+		n_fixed = len(fixed_soln) - 1
+		dvs = battery.dv_vecs.iloc[:n_fixed]
+		fixed = [dvs.at[0, 'E']] + [dv for dv_type in ('Pch', 'Pdis', 'b') for dv in dvs[dv_type]]
+		values = [fixed_soln.at[0, 'E']] + [val for dv_type in ('Pch', 'Pdis', 'b')
+		                                     for val in fixed_soln[dv_type].values[:n_fixed].astype('f8')]
+		battery.prob.setAttr('LB', fixed, values)
+		battery.prob.setAttr('UB', fixed, values)
+	battery.solve()
+	assert battery.prob.status == 2
+	return battery
+
+
+@pytest.mark.parametrize('templates', [True, False], ids=['template', 'var-by-var'])
+@pytest.mark.parametrize('start_time, offset, N, M', PERIODS, ids=['jan', 'dst'])
+@pytest.mark.parametrize('fix_history', [False, True, 'True then False'])
+def test_append_matches_fresh_solve(prices, templates, start_time, offset, N, M, fix_history):
+	head = prices[offset:offset+N]
+	tail = prices[offset+N:offset+N+M]
+
+	battery = _battery(head, start_time, templates)
+	battery.solve()
+	head_soln = battery.dv_soln.copy()
+
+	if fix_history == 'True then False':
+		# Fix the history over the first half of the tail, then release it with the second half
+		half = M // 2
+		battery.append_prices(tail[:half], fix_history=True)
+		battery.solve()
+		battery.append_prices(tail[half:], fix_history=False)
+		reference = _fresh(prices[offset:offset+N+M], start_time, templates)
+	else:
+		battery.append_prices(tail, fix_history=fix_history)
+		reference = _fresh(prices[offset:offset+N+M], start_time, templates, head_soln if fix_history else None)
+
+	battery.solve()
+	assert battery.prob.status == 2
+	assert battery.prob.objVal == pytest.approx(reference.prob.objVal, abs=1e-6)
+	assert len(battery.dv_soln) == N + M + 1
+	assert battery.earnings.iloc[-1] == pytest.approx(reference.earnings.iloc[-1], abs=1e-6)
+
+
+def test_append_empty_is_noop(prices):
+	battery = _battery(prices[:24], ('01/01/2018', 1), True)
+	battery.solve()
+	objective = battery.prob.objVal
+
+	battery.append_prices([])
+	with pytest.raises(ValueError):
+		battery.append_prices(np.ones((2, 2)))
+
+	assert len(battery.prices) == 24
+	battery.solve()
+	assert battery.prob.objVal == pytest.approx(objective)
@@ -0,0 +1,117 @@
+"""Model templates (templates.py): the template build must give the same model as the variable-by-variable build, and
+the cache must be safe across threads."""
+import threading
+import time
+
+import numpy as np
+import pytest
+
+pytest.importorskip('gurobipy')
+pytest.importorskip('scipy')
+
+import batopt as bo
+import templates
+
+START = ('01/01/2018', 1)
+
+
+def _model(prices, use_templates, model='Tesla Powerpack'):
+	battery = bo.batopt(model, quiet=True)
+	battery.options['Model templates'] = use_templates
+	battery.set_prices(prices, start_time=START, market_time=bo.CA_time)
+	return battery
+
+
+def _by_name(battery):
+	"""Returns the model as (A, rhs, sense, lb, ub, vtype, obj), with the rows and columns sorted by name."""
+	prob = battery.prob
+	prob.update()
+	dvs = sorted(prob.getVars(), key=lambda dv: dv.VarName)
+	constrs = sorted(prob.getConstrs(), key=lambda constr: constr.ConstrName)
+	col = {dv.index: pos for pos, dv in enumerate(dvs)}
+
+	A = np.zeros((len(constrs), len(dvs)))
+	for row, constr in enumerate(constrs):
+		expr = prob.getRow(constr)
+		for k in range(expr.size()):
+			A[row, col[expr.getVar(k).index]] += expr.getCoeff(k)
+
+	return (A, [c.RHS for c in constrs], [c.Sense for c in constrs], [dv.LB for dv in dvs], [dv.UB for dv in dvs],
+	        [dv.VType for dv in dvs], [dv.Obj for dv in dvs], [dv.VarName for dv in dvs],
+	        [c.ConstrName for c in constrs])
+
+
+@pytest.mark.skipif(not bo.GUROBI_MATRIX_API, reason="The model templates need Gurobi 10+")
+@pytest.mark.parametrize('n_steps', [1, 24, 71])
+def test_template_matches_varbyvar(n_steps):
+	prices = np.random.default_rng(n_steps).normal(0.03, 0.02, n_steps)
+	templates.cache.clear()
+
+	built = _model(prices, True)
+	legacy = _model(prices, False)
+	assert 'template' in built.timings and 'template' not in legacy.timings
+
+	for ours, theirs in zip(_by_name(built), _by_name(legacy)):
+		np.testing.assert_array_equal(np.asarray(ours), np.asarray(theirs))
+
+	built.solve()
+	legacy.solve()
+	assert built.prob.objVal == pytest.approx(legacy.prob.objVal, abs=1e-9)
+
+
+def test_cache_concurrent_get():
+	batspecs = bo.get_BatteryDefns()['Tesla Powerpack']
+	cache = templates.TemplateCache(maxsize=1)
+	errors = []
+
+	def worker(n_steps):
+		try:
+			for _ in range(20):
+				template, _ = cache.get(n_steps, 1.0, batspecs)
+				assert template['A'].shape[1] == 4*n_steps + 1
+		except Exception as exc:
+			errors.append(exc)
+
+	# Two keys in a cache of one: the templates are evicted while other threads wait for them
+	threads = [threading.Thread(target=worker, args=(24 + i % 2,)) for i in range(8)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+
+	assert not errors
+	assert not cache._key_locks
+
+
+def test_cache_rebuild_after_eviction(monkeypatch):
+	"""A thread that waited for a build and then finds the template evicted builds it again."""
+	batspecs = bo.get_BatteryDefns()['Tesla Powerpack']
+	cache = templates.TemplateCache()
+	build = templates.build_template
+
+	def slow_build(key):
+		time.sleep(0.1)
+		return build(key)
+
+	monkeypatch.setattr(templates, 'build_template', slow_build)
+	# Evicted as soon as stored
+	monkeypatch.setattr(cache, '_memory_hit', lambda key: None)
+
+	sources, errors = [], []
+
+	def worker():
+		try:
+			sources.append(cache.get(24, 1.0, batspecs)[1])
+		except Exception as exc:
+			errors.append(exc)
+
+	threads = [threading.Thread(target=worker) for _ in range(2)]
+	for thread in threads:
+		thread.start()
+		time.sleep(0.02)
+	for thread in threads:
+		thread.join()
+
+	assert not errors
+	assert sources == ['built', 'built']
+	assert not cache._key_locks